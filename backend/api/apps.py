@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from foodgram.db import checks  # noqa: F401
+        from . import signals  # noqa: F401
+        from .checks import check_shared_cache  # noqa: F401
+        from .metrics import instrument_serializers
+        instrument_serializers()
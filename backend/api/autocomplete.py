@@ -0,0 +1,66 @@
+import threading
+from bisect import bisect_left
+
+from recipes.models import Ingredient
+from .caching import get_generation
+
+# Sorts after any character, closes the range of keys sharing a prefix.
+PREFIX_END = '\U0010ffff'
+
+
+class IngredientPrefixIndex:
+    """
+    In-memory autocomplete index over ingredient names.
+
+    Lower-cased names are kept sorted, so names starting with the query are
+    a contiguous slice found with two binary searches. Names that only
+    contain the query are found with a scan, and only when prefix matches
+    do not fill the limit. The index is rebuilt lazily when the
+    ``ingredients`` cache generation changes.
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.entries = ([], [])
+        self.lock = threading.Lock()
+
+    def build(self, ingredients):
+        """Index ``(id, name, measurement_unit)`` rows."""
+        rows = sorted(
+            ingredients, key=lambda row: (row[1].lower(), row[2], row[0])
+        )
+        self.entries = ([row[1].lower() for row in rows], rows)
+
+    def refresh(self):
+        generation = get_generation('ingredients')
+        if generation == self.generation:
+            return
+        with self.lock:
+            if generation != self.generation:
+                self.build(
+                    Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    ).iterator()
+                )
+                self.generation = generation
+
+    def search(self, query, limit):
+        """Prefix matches first, then substring matches, up to ``limit``."""
+        keys, rows = self.entries
+        query = query.lstrip().lower()
+        if not query or limit <= 0:
+            return []
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + PREFIX_END, start)
+        found = rows[start:min(end, start + limit)]
+        if len(found) < limit:
+            for position, key in enumerate(keys):
+                if start <= position < end or query not in key:
+                    continue
+                found.append(rows[position])
+                if len(found) == limit:
+                    break
+        return found
+
+
+ingredient_index = IngredientPrefixIndex()
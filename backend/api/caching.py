@@ -0,0 +1,126 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_generation(name):
+    """
+    Current generation token of a group of cached data.
+
+    The token is the time of the last invalidation in nanoseconds, so it
+    doubles as the Last-Modified date. A missing token (first use or cache
+    eviction) starts a new generation, which never reuses stale entries.
+    """
+    cache = get_cache()
+    key = 'generation:{}'.format(name)
+    generation = cache.get(key)
+    if generation is None:
+        generation = time.time_ns()
+        if not cache.add(key, generation, timeout=None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(name):
+    """Invalidate everything cached under the ``name`` generation."""
+    get_cache().set(
+        'generation:{}'.format(name), time.time_ns(), timeout=None
+    )
+
+
+def advance_generation(name):
+    """
+    Step the ``name`` generation by one and return it, or None when the
+    token was evicted meanwhile (a new generation is started instead).
+
+    Consecutive tokens let readers replay the changes they missed. A
+    restarted generation is a new timestamp, far from any stepped one.
+    """
+    get_generation(name)
+    try:
+        return get_cache().incr('generation:{}'.format(name))
+    except ValueError:
+        bump_generation(name)
+        return None
+
+
+class CachedCatalogMixin:
+    """
+    Serve ``list`` and ``retrieve`` of a read-only viewset from JSON bytes
+    rendered once per catalog generation, with ETag and Last-Modified
+    headers for conditional requests.
+
+    ``catalog_name`` names the generation that signal handlers bump when
+    the underlying table changes. Views whose responses depend on the user
+    limit caching with ``is_cacheable``; ``catalog_max_age`` lets shared
+    caches keep the responses too.
+    """
+    catalog_name = None
+    catalog_timeout = None
+    catalog_max_age = None
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_cacheable():
+            return super().list(request, *args, **kwargs)
+        return self.get_cached_response(super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.is_cacheable():
+            return super().retrieve(request, *args, **kwargs)
+        return self.get_cached_response(super().retrieve, *args, **kwargs)
+
+    def is_cacheable(self):
+        return True
+
+    def get_cache_key(self, generation):
+        # Normalized: parameter and value order do not matter. The host is
+        # part of the key, pagination links are absolute.
+        query = sorted(
+            (name, sorted(values))
+            for name, values in self.request.query_params.lists()
+        )
+        return 'catalog:{}:{}:{}'.format(
+            self.catalog_name,
+            generation,
+            hashlib.md5(
+                repr((self.request.get_host(), self.request.path, query))
+                .encode()
+            ).hexdigest(),
+        )
+
+    def get_cached_response(self, view, *args, **kwargs):
+        cache = get_cache()
+        generation = get_generation(self.catalog_name)
+        key = self.get_cache_key(generation)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(self.request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = (content, hashlib.md5(content).hexdigest())
+            cache.set(key, entry, timeout=self.catalog_timeout)
+        content, etag = entry
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(generation // 10 ** 9)
+        if self.catalog_max_age is not None:
+            patch_cache_control(
+                response, public=True, max_age=self.catalog_max_age
+            )
+        return get_conditional_response(
+            self.request,
+            etag=response['ETag'],
+            last_modified=generation // 10 ** 9,
+            response=response,
+        )
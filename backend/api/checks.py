@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.core.exceptions import ImproperlyConfigured
+
+# Backends whose entries live in one process only.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs=None, **kwargs):
+    """
+    Generation tokens, cached catalogs and export jobs must be seen by
+    every app server worker and by management commands.
+    """
+    if settings.WEB_WORKERS <= 1:
+        return []
+    errors = []
+    for alias in sorted({
+        'default', settings.CATALOG_CACHE_ALIAS, settings.EXPORT_CACHE_ALIAS
+    }):
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend in PROCESS_LOCAL_CACHES:
+            errors.append(Error(
+                'The "{}" cache ({}) is local to each process, but '
+                'WEB_WORKERS is {}.'.format(
+                    alias, backend.rpartition('.')[2], settings.WEB_WORKERS
+                ),
+                hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared '
+                     'cache such as memcached, or WEB_WORKERS=1.',
+                id='foodgram.E001',
+            ))
+    return errors
+
+
+def require_shared_cache():
+    """Refuse to start an app server that would fail the check."""
+    for error in check_shared_cache():
+        raise ImproperlyConfigured('{} {}'.format(error.msg, error.hint))
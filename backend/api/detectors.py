@@ -0,0 +1,223 @@
+"""
+Query problem detectors.
+
+``QueryDetectorMiddleware`` watches the SQL of a QUERY_DETECTOR_SAMPLE_RATE
+share of requests. Every query is attributed to the code that issued it:
+the innermost project frame, and the serializer field or view method it
+ran for. Detectors listed in QUERY_DETECTORS see each query and report
+problems as structured warnings on the ``api.detectors`` logger. With
+QUERY_DETECTOR_STRICT (meant for tests) a detector that supports it raises
+QueryProblem instead, from inside the offending call.
+
+A detector is a class built with the request's ``Watch`` and implementing
+``on_query(event)`` and ``on_finish()``.
+"""
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+from rest_framework.fields import Field
+from rest_framework.views import APIView
+
+from .metrics import normalize_sql, view_name
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_PATHS = tuple(
+    os.path.dirname(module.__file__)
+    for module in (sys.modules['django'], sys.modules['rest_framework'])
+) + ('site-packages', os.path.dirname(os.__file__))
+
+
+# Middleware frames sit below every query of a request.
+INSTRUMENTATION = {
+    os.path.abspath(module.__file__)
+    for module in (sys.modules[__name__], sys.modules['api.metrics'])
+}
+
+
+class QueryProblem(AssertionError):
+    pass
+
+
+class QueryEvent:
+    def __init__(self, sql, duration, location, owner):
+        self.sql = sql
+        self.shape = normalize_sql(sql)
+        self.duration = duration
+        self.location = location
+        self.owner = owner
+
+
+@lru_cache(maxsize=None)
+def is_project_file(path):
+    path = os.path.abspath(path)
+    return (
+        path.startswith(str(settings.BASE_DIR))
+        and path not in INSTRUMENTATION
+        and not any(library in path for library in LIBRARY_PATHS)
+    )
+
+
+def describe_caller(frame):
+    """
+    ``(location, owner)`` of the code running a query: the innermost
+    project frame as ``path:line in function``, and the serializer field
+    (``Serializer.field``, ``Serializer.get_field``) or view method
+    (``View.method``) it belongs to.
+    """
+    location = owner = None
+    while frame is not None and (location is None or owner is None):
+        code = frame.f_code
+        if location is None and is_project_file(code.co_filename):
+            location = '{}:{} in {}'.format(
+                os.path.relpath(code.co_filename, settings.BASE_DIR),
+                frame.f_lineno,
+                code.co_name,
+            )
+        if owner is None and 'self' in code.co_varnames[:1]:
+            this = frame.f_locals.get('self')
+            if isinstance(this, APIView):
+                owner = '{}.{}'.format(type(this).__name__, code.co_name)
+            elif isinstance(this, Field):
+                if code.co_name.startswith('get_'):
+                    # A serializer method field's method.
+                    owner = '{}.{}'.format(type(this).__name__, code.co_name)
+                elif this.field_name and this.parent is not None:
+                    owner = '{}.{}'.format(
+                        type(this.parent).__name__, this.field_name
+                    )
+        frame = frame.f_back
+    return location, owner
+
+
+class Watch:
+    """The queries of one request (or block) and its detectors."""
+
+    def __init__(self, label, detectors, strict=False):
+        self.label = label
+        self.strict = strict
+        self.detectors = [detector(self) for detector in detectors]
+
+    def label_text(self):
+        return self.label() if callable(self.label) else self.label
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook."""
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - start
+        location, owner = describe_caller(sys._getframe(1))
+        event = QueryEvent(sql, duration, location, owner)
+        for detector in self.detectors:
+            detector.on_query(event)
+        return result
+
+    def finish(self):
+        for detector in self.detectors:
+            detector.on_finish()
+
+    def report(self, problem, event, raises=False, **fields):
+        """Log a structured warning, or raise it in strict mode."""
+        fields = dict(
+            problem=problem,
+            view=self.label_text(),
+            owner=event.owner,
+            location=event.location,
+            shape=event.shape,
+            **fields
+        )
+        message = '{problem} in {view}: {owner} at {location}: {shape}'
+        message = message.format(**fields)
+        if raises and self.strict:
+            raise QueryProblem(message)
+        logger.warning(message, extra={'query_problem': fields})
+
+
+class RepeatedQueryDetector:
+    """
+    N+1: the same statement shape issued from the same place
+    QUERY_REPEAT_THRESHOLD times or more.
+    """
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.threshold = settings.QUERY_REPEAT_THRESHOLD
+        self.counts = {}
+        self.first = {}
+
+    def on_query(self, event):
+        key = (event.shape, event.location)
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        self.first.setdefault(key, event)
+        if count == self.threshold and self.watch.strict:
+            self.watch.report('n_plus_one', event, raises=True, count=count)
+
+    def on_finish(self):
+        for key, count in self.counts.items():
+            if count >= self.threshold:
+                self.watch.report('n_plus_one', self.first[key], count=count)
+
+
+class SlowQueryDetector:
+    """
+    Queries over QUERY_SLOW_MS. Timings depend on the machine, so this
+    one never raises.
+    """
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.limit = settings.QUERY_SLOW_MS / 1000
+
+    def on_query(self, event):
+        if event.duration >= self.limit:
+            self.watch.report(
+                'slow_query', event,
+                duration_ms=round(event.duration * 1000, 1)
+            )
+
+    def on_finish(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def load_detectors(paths):
+    return [import_string(path) for path in paths]
+
+
+@contextmanager
+def watch_queries(label, detectors=None, strict=None):
+    """Run the detectors on the queries of every connection in the block."""
+    watch = Watch(
+        label,
+        load_detectors(tuple(
+            settings.QUERY_DETECTORS if detectors is None else detectors
+        )),
+        settings.QUERY_DETECTOR_STRICT if strict is None else strict,
+    )
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(watch))
+        yield watch
+    watch.finish()
+
+
+class QueryDetectorMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (
+            not settings.QUERY_DETECTORS
+            or random.random() >= settings.QUERY_DETECTOR_SAMPLE_RATE
+        ):
+            return self.get_response(request)
+        with watch_queries(lambda: view_name(request)):
+            return self.get_response(request)
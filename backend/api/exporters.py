@@ -0,0 +1,257 @@
+import copy
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from fpdf import FPDF
+
+logger = logging.getLogger(__name__)
+
+FONT_FAMILY = 'Attractive'
+FONT_PATH = os.path.join(settings.BASE_DIR, 'font', 'Attractive-Regular.ttf')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_executor_lock = threading.Lock()
+_executor = None
+_pdf_template_lock = threading.Lock()
+_pdf_template = None
+
+
+def get_cache():
+    return caches[settings.EXPORT_CACHE_ALIAS]
+
+
+def get_pdf_template():
+    """
+    An empty document with the font registered, parsed once per process.
+    Copying it costs a tenth of add_font() and uses public fpdf2 API only.
+    """
+    global _pdf_template
+    with _pdf_template_lock:
+        if _pdf_template is None:
+            template = FPDF()
+            template.add_font(family=FONT_FAMILY, fname=FONT_PATH)
+            _pdf_template = template
+        return _pdf_template
+
+
+def format_line(ingredient):
+    return '{} - {} {}'.format(
+        ingredient['name'].capitalize(),
+        ingredient['amount'],
+        ingredient['measurement_unit'],
+    )
+
+
+class Exporter:
+    """
+    Shopping list format. Streaming exporters turn the aggregated rows
+    into text chunks as they are read from the database; the others
+    render a whole document, which is cached and may be rendered in the
+    worker pool.
+    """
+    name = None
+    content_type = None
+    streaming = True
+
+    @property
+    def filename(self):
+        return 'shopping_cart.{}'.format(self.name)
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+    def render(self, ingredients):
+        return ''.join(self.stream(ingredients)).encode()
+
+
+class TextExporter(Exporter):
+    name = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def stream(self, ingredients):
+        for ingredient in ingredients:
+            yield format_line(ingredient) + '\n'
+
+
+class _Line:
+    """File-like object that hands back what ``csv.writer`` writes."""
+
+    def write(self, value):
+        return value
+
+
+class CSVExporter(Exporter):
+    name = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+    header = ('name', 'amount', 'measurement_unit')
+
+    def stream(self, ingredients):
+        writer = csv.writer(_Line())
+        yield writer.writerow(self.header)
+        for ingredient in ingredients:
+            yield writer.writerow(
+                [ingredient[field] for field in self.header]
+            )
+
+
+class JSONExporter(Exporter):
+    name = 'json'
+    content_type = 'application/json'
+
+    def stream(self, ingredients):
+        separator = '['
+        for ingredient in ingredients:
+            yield separator + json.dumps(
+                {
+                    'id': ingredient['ingredient_id'],
+                    'name': ingredient['name'],
+                    'measurement_unit': ingredient['measurement_unit'],
+                    'amount': ingredient['amount'],
+                },
+                ensure_ascii=False,
+            )
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+class PDFExporter(Exporter):
+    name = 'pdf'
+    content_type = 'application/pdf'
+    streaming = False
+
+    def render(self, ingredients):
+        pdf = copy.deepcopy(get_pdf_template())
+        pdf.add_page()
+        pdf.set_font(FONT_FAMILY, '', 16)
+        for ingredient in ingredients:
+            pdf.cell(
+                40,
+                10,
+                format_line(ingredient),
+                new_x='LMARGIN',
+                new_y='NEXT',
+                align='L'
+            )
+        return bytes(pdf.output())
+
+
+EXPORTERS = {
+    exporter.name: exporter
+    for exporter in (PDFExporter(), TextExporter(), CSVExporter(),
+                     JSONExporter())
+}
+DEFAULT_FORMAT = 'pdf'
+
+
+def get_exporter(name):
+    return EXPORTERS.get(name)
+
+
+def cart_digest(ingredients):
+    """Hash of the aggregated cart, the cache key of its documents."""
+    payload = json.dumps(
+        [
+            [
+                row['ingredient_id'],
+                row['name'],
+                row['measurement_unit'],
+                row['amount'],
+            ]
+            for row in ingredients
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _document_key(exporter, user_id, digest):
+    return 'shopping-cart:{}:{}:{}'.format(exporter.name, user_id, digest)
+
+
+def _job_key(user_id, job_id):
+    return 'shopping-cart:job:{}:{}'.format(user_id, job_id)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS,
+                thread_name_prefix='export',
+            )
+        return _executor
+
+
+def get_cached_document(exporter, user_id, digest):
+    return get_cache().get(_document_key(exporter, user_id, digest))
+
+
+def render_cached_document(exporter, user_id, digest, ingredients):
+    content = exporter.render(ingredients)
+    get_cache().set(
+        _document_key(exporter, user_id, digest),
+        content,
+        timeout=settings.EXPORT_CACHE_TIMEOUT
+    )
+    return content
+
+
+def _set_job_status(user_id, job_id, exporter, status):
+    get_cache().set(
+        _job_key(user_id, job_id),
+        {'status': status, 'format': exporter.name},
+        timeout=settings.EXPORT_CACHE_TIMEOUT
+    )
+
+
+def _run_job(exporter, user_id, digest, ingredients, job_id):
+    try:
+        render_cached_document(exporter, user_id, digest, ingredients)
+    except Exception:
+        logger.exception('Shopping cart export %s failed', job_id)
+        _set_job_status(user_id, job_id, exporter, FAILED)
+    else:
+        _set_job_status(user_id, job_id, exporter, DONE)
+
+
+def start_job(exporter, user_id, digest, ingredients):
+    """
+    Render the document in the worker pool. The job id is derived from
+    the format and the cart digest, so asking again for the same cart
+    joins the running job. A failed job, or a done one whose document
+    has been evicted since, is started over.
+    """
+    job_id = '{}-{}'.format(exporter.name, digest)
+    key = _job_key(user_id, job_id)
+    job = get_cache().get(key)
+    if job is not None and (
+        job['status'] == FAILED
+        or job['status'] == DONE
+        and get_cached_document(exporter, user_id, digest) is None
+    ):
+        get_cache().delete(key)
+    if get_cache().add(
+        key,
+        {'status': PENDING, 'format': exporter.name},
+        timeout=settings.EXPORT_CACHE_TIMEOUT
+    ):
+        get_executor().submit(
+            _run_job, exporter, user_id, digest, ingredients, job_id
+        )
+    return job_id
+
+
+def get_job(user_id, job_id):
+    """``{'status': ..., 'format': ...}`` of a job, None if unknown."""
+    return get_cache().get(_job_key(user_id, job_id))
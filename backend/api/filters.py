@@ -1,13 +1,38 @@
+from django import forms
+from django.db.models import Exists, F, OuterRef
 from django_filters import rest_framework as filters
 
-from recipes.models import Recipe
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
+from .caching import get_cache, get_generation
+
+
+def get_tag_ids_by_slug():
+    """Lower-cased tag slug -> tag ids, cached per ``tags`` generation."""
+    cache = get_cache()
+    key = 'tag-slugs:{}'.format(get_generation('tags'))
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = {}
+        for pk, slug in Tag.objects.values_list('id', 'slug'):
+            tag_ids.setdefault(slug.lower(), []).append(pk)
+        cache.set(key, tag_ids, timeout=None)
+    return tag_ids
+
+
+class SlugsField(forms.MultipleChoiceField):
+    """Any number of slugs; unknown ones simply match nothing."""
+
+    def valid_value(self, value):
+        return True
+
+
+class MultipleSlugFilter(filters.MultipleChoiceFilter):
+    field_class = SlugsField
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.CharFilter(
-        field_name='tags__slug',
-        lookup_expr='iexact'
-    )
+    tags = MultipleSlugFilter(method='filter_tags')
     is_favorited = filters.BooleanFilter(
         field_name='is_favorited',
         method='filter_favorited'
@@ -16,26 +41,58 @@ class RecipeFilter(filters.FilterSet):
         field_name='is_in_shopping_cart',
         method='filter_shopping'
     )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='order_by_rank'
+    )
+    # After ``ordering``, whose rank takes precedence over relevance.
+    search = filters.CharFilter(method='filter_search')
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Recipes with any of the tags. An ``EXISTS`` on the through table
+        matches each recipe once, so no ``DISTINCT`` is needed.
+        """
+        tag_ids_by_slug = get_tag_ids_by_slug()
+        tag_ids = {
+            pk
+            for slug in value
+            for pk in tag_ids_by_slug.get(slug.lower(), ())
+        }
+        if not tag_ids:
+            return queryset.none()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__in=tag_ids
+            )
+        ))
 
     def filter_favorited(self, queryset, name, value):
-        user = self.request.user
-        if value == 1:
-            filtered_queryset = queryset.filter(pk__in=user.favorites.all())
-        if value == 0:
-            filtered_queryset = queryset.exclude(pk__in=user.favorites.all())
-        return filtered_queryset
+        return queryset.filter(is_favorited=value)
 
     def filter_shopping(self, queryset, name, value):
-        user = self.request.user
-        if value == 1:
-            filtered_queryset = queryset.filter(
-                pk__in=user.shopping_cart.all()
-            )
-        if value == 0:
-            filtered_queryset = queryset.exclude(
-                pk__in=user.shopping_cart.all()
-            )
-        return filtered_queryset
+        return queryset.filter(is_in_shopping_cart=value)
+
+    def filter_search(self, queryset, name, value):
+        """
+        Full-text search, most relevant first unless ``ordering`` asks for
+        another rank.
+        """
+        queryset = search_recipes(queryset, value)
+        annotations = queryset.query.annotations
+        if 'relevance' not in annotations or 'rank' in annotations:
+            return queryset
+        return queryset.annotate(rank=F('relevance')).order_by('-rank', '-id')
+
+    def order_by_rank(self, queryset, name, value):
+        """
+        Order by a precomputed RecipeScore column, newest first on ties.
+        The inner join and the tie-breaker on the score's own key let the
+        database read the first page straight from the score index.
+        """
+        return queryset.filter(score__isnull=False).annotate(
+            rank=F('score__{}'.format(value))
+        ).order_by('-rank', '-score')
 
     class Meta:
         model = Recipe
@@ -0,0 +1,223 @@
+"""
+Recipe image pipeline.
+
+Uploads are decoded chunk by chunk into a spooled temporary file while
+their SHA-256 is computed, checked against size and dimension limits
+before anything is stored, and saved under their content hash. Resized
+WebP and JPEG variants are rendered by a worker pool once the recipe is
+committed and recorded in ``Recipe.image_variants``.
+"""
+import binascii
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+from .caching import bump_generation
+
+logger = logging.getLogger(__name__)
+
+# Pillow format -> extension of the stored original.
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+VARIANT_FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+VARIANTS_DIR = 'recipes/images/variants'
+# Characters of base64 read per step.
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+# Refuse decompression bombs in every Pillow call of the process.
+Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def spool_base64(data, start, max_bytes):
+    """
+    Decode the base64 text of ``data`` from ``start`` on into a spooled
+    temporary file, one chunk at a time, so no second full copy is made.
+    Line breaks and other whitespace may fall anywhere, as in MIME-wrapped
+    base64. Return the file and the SHA-256 hex digest of its content;
+    raise ImageTooLarge past ``max_bytes`` and binascii.Error on bad input.
+    """
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    digest = hashlib.sha256()
+    size = 0
+    remainder = ''
+    for position in range(start, len(data), CHUNK_SIZE):
+        text = data[position:position + CHUNK_SIZE]
+        text = remainder + ''.join(text.split())
+        # Whole quads only; the rest is decoded with the next chunk.
+        end = len(text) - len(text) % 4
+        text, remainder = text[:end], text[end:]
+        chunk = binascii.a2b_base64(text)
+        size += len(chunk)
+        if size > max_bytes:
+            spool.close()
+            raise ImageTooLarge
+        digest.update(chunk)
+        spool.write(chunk)
+    if remainder:
+        spool.close()
+        raise binascii.Error('Incorrect padding')
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def spool_upload(upload, max_bytes):
+    """``spool_base64`` for an uploaded file, hashed in chunks."""
+    if upload.size is not None and upload.size > max_bytes:
+        raise ImageTooLarge
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    return upload, digest.hexdigest()
+
+
+def inspect_image(file):
+    """
+    Pillow format and size of an image, read from its header only. Raise
+    ImageTooLarge past IMAGE_MAX_PIXELS and ValueError if it is not an
+    image of a supported format.
+    """
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise ImageTooLarge
+    except (OSError, SyntaxError):
+        raise ValueError
+    finally:
+        file.seek(0)
+    if image_format not in FORMATS:
+        raise ValueError
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge
+    return image_format
+
+
+def hashed_file(file, digest, image_format):
+    """
+    File named after its content. An identical upload already in storage
+    is reused by name instead of being stored again.
+    """
+    name = '{}.{}'.format(digest[:32], FORMATS[image_format])
+    path = '{}/{}'.format(Recipe.image.field.upload_to, name)
+    if default_storage.exists(path):
+        file.close()
+        return path
+    return File(file, name=name)
+
+
+def variant_path(source, variant, extension):
+    base = os.path.splitext(os.path.basename(source))[0]
+    return '{}/{}-{}.{}'.format(VARIANTS_DIR, base, variant, extension)
+
+
+def render_variants(source):
+    """
+    Store the resized variants of the ``source`` image and return their
+    paths as ``{variant: {format: path}}``.
+    """
+    with default_storage.open(source) as file, Image.open(file) as image:
+        image.seek(0)
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    variants = {}
+    for variant, side in settings.IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((side, side), Image.Resampling.LANCZOS)
+        flat = Image.new('RGB', resized.size, 'white')
+        flat.paste(resized, mask=resized.getchannel('A'))
+        variants[variant] = {}
+        for extension, image_format in VARIANT_FORMATS:
+            path = variant_path(source, variant, extension)
+            if not default_storage.exists(path):
+                buffer = io.BytesIO()
+                (resized if image_format == 'WEBP' else flat).save(
+                    buffer, image_format, quality=settings.IMAGE_QUALITY
+                )
+                path = default_storage.save(
+                    path, ContentFile(buffer.getvalue())
+                )
+            variants[variant][extension] = path
+    return variants
+
+
+def create_variants(recipe_id):
+    """
+    Render the variants of a recipe's image and record them, unless the
+    image was replaced meanwhile.
+    """
+    source = (
+        Recipe.objects.filter(pk=recipe_id)
+        .values_list('image', flat=True)
+        .first()
+    )
+    if not source:
+        return
+    variants = render_variants(source)
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_variants={'source': source, 'files': variants},
+        modified=timezone.now(),
+    )
+    if updated:
+        bump_generation('recipes')
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='images',
+            )
+        return _executor
+
+
+def _run_variants(recipe_id):
+    try:
+        create_variants(recipe_id)
+    except Exception:
+        logger.exception('Image variants of recipe %s failed', recipe_id)
+
+
+def _run_variants_in_worker(recipe_id):
+    # Worker threads never reach the request boundaries where connections
+    # are health-checked and given back to the pool, so each job does it.
+    close_old_connections()
+    try:
+        _run_variants(recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe_id):
+    """Render in the worker pool, or right away without workers."""
+    if settings.IMAGE_WORKERS:
+        get_executor().submit(_run_variants_in_worker, recipe_id)
+    else:
+        _run_variants(recipe_id)
+
+
+def needs_variants(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name
+    )
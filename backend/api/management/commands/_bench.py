@@ -0,0 +1,130 @@
+"""
+Shared helpers for the ``bench_*`` management commands.
+
+Benchmarks seed their own data inside a transaction that is always rolled
+back, so they are safe to run against a populated database.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+from users.models import User
+
+BENCH_IMAGE = 'recipes/images/bench.png'
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is rolled back on exit."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def analyze():
+    """Refresh planner statistics after seeding, as autovacuum would."""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(func, repeat=5):
+    """
+    Call ``func`` once counting queries and ``repeat`` more times with a
+    stopwatch. Return the query count and the median latency in ms.
+    """
+    executed = []
+
+    def count_query(execute, sql, params, many, context):
+        executed.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(executed), statistics.median(timings)
+
+
+def create_user(username):
+    return User.objects.create(
+        username=username,
+        email='{}@bench.local'.format(username),
+        first_name='Bench',
+        last_name='User',
+    )
+
+
+def create_ingredients(count, prefix='ингредиент'):
+    Ingredient.objects.bulk_create(
+        Ingredient(name='{} {}'.format(prefix, i), measurement_unit='г')
+        for i in range(count)
+    )
+    return list(
+        Ingredient.objects.filter(name__startswith=prefix)
+        .values_list('id', flat=True)
+    )
+
+
+def create_recipes(author, count, ingredient_ids, per_recipe=10, seed=0,
+                   batch_size=1000, words=None):
+    """
+    Bulk-create ``count`` recipes for ``author`` with ``per_recipe``
+    random ingredients each and return their ids. With ``words`` the
+    names and texts are drawn from that vocabulary.
+    """
+    rng = random.Random(seed)
+
+    def make_recipe(i):
+        if words:
+            name = '{} {}'.format(rng.choice(words).capitalize(), i)
+            text = ' '.join(rng.sample(words, min(len(words), 12)))
+        else:
+            name = 'Рецепт {}'.format(i)
+            text = 'Описание рецепта {}'.format(i)
+        return Recipe(
+            name=name,
+            author=author,
+            image=BENCH_IMAGE,
+            text=text,
+            cooking_time=rng.randint(5, 120),
+        )
+
+    Recipe.objects.bulk_create(
+        (make_recipe(i) for i in range(count)),
+        batch_size=batch_size,
+    )
+    # SQLite does not return primary keys from bulk inserts on Django 3.2.
+    recipe_ids = list(
+        Recipe.objects.filter(author=author).values_list('id', flat=True)
+    )
+    IngredientRecipe.objects.bulk_create(
+        (
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(ingredient_ids, per_recipe)
+        ),
+        batch_size=batch_size,
+    )
+    return recipe_ids
+
+
+def print_table(stdout, header, rows):
+    widths = [
+        max(len(str(cell)) for cell in column)
+        for column in zip(header, *rows)
+    ]
+    for row in (header, *rows):
+        stdout.write('  '.join(
+            str(cell).rjust(width) for cell, width in zip(row, widths)
+        ))
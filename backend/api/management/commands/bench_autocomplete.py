@@ -0,0 +1,100 @@
+import json
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.autocomplete import IngredientPrefixIndex
+from recipes.models import Ingredient
+from ._bench import analyze, measure, print_table, rolled_back
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the in-memory ingredient autocomplete index with the '
+        'name__istartswith ORM search. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[2000, 200000],
+            help='Catalog sizes (number of ingredients) to benchmark.'
+        )
+        parser.add_argument(
+            '--queries', type=int, default=50,
+            help='Number of random prefixes typed per catalog size.'
+        )
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        data_file = os.path.join(settings.BASE_DIR, 'data', 'ingredients.json')
+        with open(data_file) as file:
+            names = [row['name'] for row in json.load(file)]
+        rng = random.Random(options['seed'])
+        prefixes = [
+            name[:rng.randint(1, 4)]
+            for name in rng.sample(names, options['queries'])
+        ]
+        limit = options['limit']
+
+        rows = []
+        for size in options['sizes']:
+            with rolled_back():
+                Ingredient.objects.all().delete()
+                Ingredient.objects.bulk_create(
+                    (
+                        Ingredient(
+                            name='{} {}'.format(names[i % len(names)], i),
+                            measurement_unit='г'
+                        )
+                        for i in range(size)
+                    ),
+                    batch_size=5000,
+                )
+                analyze()
+                index = IngredientPrefixIndex()
+                start = time.perf_counter()
+                index.build(
+                    Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    ).iterator()
+                )
+                build = (time.perf_counter() - start) * 1000
+
+                def orm_search():
+                    for prefix in prefixes:
+                        list(
+                            Ingredient.objects
+                            .filter(name__istartswith=prefix)
+                            .values_list('id', 'name', 'measurement_unit')
+                        )
+
+                def index_search():
+                    for prefix in prefixes:
+                        index.search(prefix, limit)
+
+                orm_queries, orm_ms = measure(orm_search, 3)
+                index_queries, index_ms = measure(index_search, 3)
+                rows.append([
+                    size,
+                    '{:.1f}'.format(build),
+                    orm_queries,
+                    '{:.3f}'.format(orm_ms / len(prefixes)),
+                    index_queries,
+                    '{:.3f}'.format(index_ms / len(prefixes)),
+                ])
+        print_table(
+            self.stdout,
+            [
+                'ingredients',
+                'build ms',
+                'orm queries',
+                'orm ms/query',
+                'index queries',
+                'index ms/query',
+            ],
+            rows
+        )
@@ -0,0 +1,102 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from api.matching import RecipeIngredientIndex
+from recipes.models import IngredientRecipe, Recipe
+from ._bench import (
+    analyze,
+    create_ingredients,
+    create_recipes,
+    create_user,
+    measure,
+    print_table,
+    rolled_back,
+)
+
+
+def group_by_match(ingredient_ids, missing, limit):
+    """The match as a GROUP BY over IngredientRecipe."""
+    return list(
+        Recipe.objects
+        .annotate(
+            matched=Count(
+                'ingredients',
+                filter=Q(ingredients__ingredient_id__in=ingredient_ids)
+            ),
+            total=Count('ingredients'),
+        )
+        .annotate(lacking=F('total') - F('matched'))
+        .filter(matched__gt=0, lacking__lte=missing)
+        .order_by('lacking', '-matched', '-id')
+        .values_list('id', 'matched', 'lacking')[:limit]
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the in-memory ingredient matching index with a GROUP BY '
+        'over recipe ingredients. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=300)
+        parser.add_argument('--per-recipe', type=int, default=6)
+        parser.add_argument(
+            '--have', nargs='+', type=int, default=[10, 40, 100],
+            help='Numbers of ingredients at hand to match.'
+        )
+        parser.add_argument('--missing', type=int, default=3)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        limit = options['limit']
+        missing = options['missing']
+        rows = []
+        with rolled_back():
+            author = create_user('bench-match')
+            ingredient_ids = create_ingredients(
+                options['ingredients'], prefix='bench-match'
+            )
+            create_recipes(
+                author, options['recipes'], ingredient_ids,
+                per_recipe=options['per_recipe']
+            )
+            analyze()
+            index = RecipeIngredientIndex()
+            start = time.perf_counter()
+            index.build(
+                IngredientRecipe.objects
+                .values_list('recipe_id', 'ingredient_id')
+                .iterator()
+            )
+            self.stdout.write('Index built in {:.1f} s'.format(
+                time.perf_counter() - start
+            ))
+            for size in options['have']:
+                have = rng.sample(ingredient_ids, size)
+                _, index_ms = measure(
+                    lambda: index.match(have, missing)[:limit],
+                    options['repeat']
+                )
+                queries, group_by_ms = measure(
+                    lambda: group_by_match(have, missing, limit),
+                    options['repeat']
+                )
+                rows.append([
+                    size,
+                    len(index.match(have, missing)),
+                    '{:.1f}'.format(index_ms),
+                    queries,
+                    '{:.1f}'.format(group_by_ms),
+                ])
+        print_table(
+            self.stdout,
+            ['have', 'matches', 'index ms', 'sql queries', 'sql ms'],
+            rows
+        )
@@ -0,0 +1,93 @@
+from base64 import b64encode
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewset
+from recipes.models import Recipe
+from ._bench import (
+    analyze,
+    create_ingredients,
+    create_recipes,
+    create_user,
+    measure,
+    print_table,
+    rolled_back,
+)
+
+
+def keyset_cursor(position):
+    """Cursor pointing right after the recipe with id ``position``."""
+    querystring = urlencode({'p': position})
+    return b64encode(querystring.encode('ascii')).decode('ascii')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare latency of the first and a deep page of the recipe feed '
+        'under page number and keyset pagination. Seeded data is rolled '
+        'back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--page', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        deep_page = options['page']
+        factory = APIRequestFactory()
+        view = RecipeViewset.as_view({'get': 'list'})
+
+        rows = []
+        with rolled_back():
+            author = create_user('bench-pagination')
+
+            def request(params):
+                # Authenticated: anonymous feeds are served from the
+                # response cache after the first call.
+                request = factory.get('/api/recipes/', params)
+                force_authenticate(request, user=author)
+                response = view(request)
+                assert response.status_code == 200, response.data
+
+            ingredient_ids = create_ingredients(20, prefix='bench-page')
+            create_recipes(
+                author, options['recipes'], ingredient_ids, per_recipe=2
+            )
+            analyze()
+            ids = list(
+                Recipe.objects.order_by('-id').values_list('id', flat=True)
+            )
+            if len(ids) < deep_page * limit:
+                deep_page = len(ids) // limit
+            cases = (
+                ('page number', 1, {'limit': limit, 'page': 1}),
+                (
+                    'page number',
+                    deep_page,
+                    {'limit': limit, 'page': deep_page}
+                ),
+                ('keyset', 1, {'limit': limit, 'cursor': ''}),
+                (
+                    'keyset',
+                    deep_page,
+                    {
+                        'limit': limit,
+                        'cursor': keyset_cursor(
+                            ids[(deep_page - 1) * limit - 1]
+                        ),
+                    }
+                ),
+            )
+            for name, page, params in cases:
+                queries, latency = measure(
+                    lambda: request(params), options['repeat']
+                )
+                rows.append([name, page, queries, '{:.1f}'.format(latency)])
+        print_table(
+            self.stdout, ['pagination', 'page', 'queries', 'ms'], rows
+        )
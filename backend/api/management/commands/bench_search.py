@@ -0,0 +1,105 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from recipes.models import Ingredient, Recipe
+from recipes.search import search_recipes, update_search_documents
+from ._bench import (
+    analyze,
+    create_recipes,
+    create_user,
+    measure,
+    print_table,
+    rolled_back,
+)
+
+WORDS = (
+    'суп борщ солянка щи уха рагу плов каша запеканка пирог блины оладьи '
+    'салат котлеты жаркое гуляш тефтели вареники пельмени омлет '
+    'сырники шарлотка компот морс куриный овощной грибной рыбный '
+    'домашний быстрый острый сладкий постный праздничный летний'
+).split()
+INGREDIENTS = (
+    'свёкла картофель морковь лук капуста чеснок говядина свинина курица '
+    'рыба грибы рис гречка мука яйцо молоко сметана творог сыр масло '
+    'сахар соль перец укроп петрушка томат огурец яблоко тыква фасоль'
+).split()
+QUERIES = ('борщ', 'свёкла', 'грибной суп', 'курица рис', 'сладкий пирог')
+
+
+def icontains_search(query):
+    """Substring search over the recipe and its ingredient names."""
+    condition = Q()
+    for word in query.split():
+        condition &= (
+            Q(name__icontains=word)
+            | Q(text__icontains=word)
+            | Q(ingredients__ingredient__name__icontains=word)
+        )
+    return Recipe.objects.filter(condition).distinct().order_by('-id')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare latency of the full-text recipe search with icontains '
+        'over name, text and ingredient names. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        rows = []
+        with rolled_back():
+            author = create_user('bench-search')
+            Ingredient.objects.bulk_create(
+                Ingredient(name='{} bench'.format(name), measurement_unit='г')
+                for name in INGREDIENTS
+            )
+            ingredient_ids = list(
+                Ingredient.objects.filter(name__endswith=' bench')
+                .values_list('id', flat=True)
+            )
+            create_recipes(
+                author, options['recipes'], ingredient_ids, per_recipe=5,
+                words=WORDS
+            )
+            # Statistics of the fresh rows keep the index build a hash join.
+            analyze()
+            start = time.perf_counter()
+            update_search_documents()
+            self.stdout.write('Search index built in {:.1f} s'.format(
+                time.perf_counter() - start
+            ))
+            analyze()
+            for query in QUERIES:
+                queries, search_ms = measure(
+                    lambda: list(
+                        search_recipes(Recipe.objects.all(), query)
+                        .order_by('-relevance', '-id')
+                        .values_list('id', flat=True)[:limit]
+                    ),
+                    options['repeat']
+                )
+                _, icontains_ms = measure(
+                    lambda: list(
+                        icontains_search(query)
+                        .values_list('id', flat=True)[:limit]
+                    ),
+                    options['repeat']
+                )
+                rows.append([
+                    query,
+                    queries,
+                    '{:.1f}'.format(search_ms),
+                    '{:.1f}'.format(icontains_ms),
+                ])
+        print_table(
+            self.stdout,
+            ['query', 'queries', 'search ms', 'icontains ms'],
+            rows
+        )
@@ -0,0 +1,127 @@
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.error import URLError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from api.checks import check_shared_cache
+from ._bench import print_table
+from .loadtest import Fixtures, Worker, recipe_feed, summarize
+
+SCENARIOS = (
+    ('anonymous', 1, False, recipe_feed),
+    ('authenticated', 1, True, recipe_feed),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Start gunicorn.conf.py with each --threads count in turn and '
+        'measure requests per second on the recipe list, anonymous (served '
+        'from the cache) and authenticated. Needs a dataset, see '
+        'generate_dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument(
+            '--threads', nargs='+', type=int, default=[1, 4],
+            help='Threads per worker, one run each.'
+        )
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=15)
+        parser.add_argument('--warmup', type=float, default=3)
+        parser.add_argument('--port', type=int, default=8790)
+        parser.add_argument('--user-prefix', default='load')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # The workers would refuse to start.
+        with override_settings(WEB_WORKERS=options['workers']):
+            for error in check_shared_cache():
+                raise CommandError('{} {}'.format(error.msg, error.hint))
+        fixtures = Fixtures(
+            random.Random(options['seed']), 50, options['user_prefix']
+        )
+        if not fixtures.tokens:
+            raise CommandError('No users named {}*, pass --user-prefix.'
+                               .format(options['user_prefix']))
+        url = 'http://127.0.0.1:{}'.format(options['port'])
+        rows = []
+        for threads in options['threads']:
+            server = self.start(threads, url, options)
+            try:
+                results = self.drive(url, fixtures, options)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+            for name, stats in results['endpoints'].items():
+                rows.append([
+                    threads, name, stats['requests'], stats['errors'],
+                    '{:.1f}'.format(stats['rps']),
+                    '{:.1f}'.format(stats['p50']),
+                    '{:.1f}'.format(stats['p95']),
+                    '{:.1f}'.format(stats['p99']),
+                ])
+        print_table(
+            self.stdout,
+            ['threads', 'recipe list', 'requests', 'errors', 'rps',
+             'p50 ms', 'p95 ms', 'p99 ms'],
+            rows
+        )
+
+    def start(self, threads, url, options):
+        env = dict(
+            os.environ,
+            BIND=url[len('http://'):],
+            WEB_WORKERS=str(options['workers']),
+            WEB_THREADS=str(threads),
+        )
+        server = subprocess.Popen(
+            [
+                sys.executable, '-m', 'gunicorn',
+                '--config',
+                os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(url + '/api/tags/', timeout=1).read()
+                return server
+            except (URLError, OSError):
+                if server.poll() is not None:
+                    break
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(
+            'gunicorn did not start with {} threads.'.format(threads)
+        )
+
+    def drive(self, url, fixtures, options):
+        start = time.perf_counter() + options['warmup']
+        stop = start + options['duration']
+        worker_options = dict(options, url=url, timeout=30)
+        workers = [
+            Worker(number, worker_options, fixtures, SCENARIOS, start, stop)
+            for number in range(options['concurrency'])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return summarize(
+            [result for worker in workers for result in worker.results],
+            options['duration'],
+            SCENARIOS,
+        )
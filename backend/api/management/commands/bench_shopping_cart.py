@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+
+from api.services import get_shopping_cart_ingredients
+from ._bench import (
+    analyze,
+    create_ingredients,
+    create_recipes,
+    create_user,
+    measure,
+    print_table,
+    rolled_back,
+)
+
+
+def legacy_shopping_cart(user):
+    """Per-recipe loop the download view used before the aggregation."""
+    ingredients = {}
+    for recipe in user.shopping_cart.all():
+        for ingredient_recipe in recipe.ingredients.all():
+            ingredient = ingredient_recipe.ingredient
+            if ingredient.id in ingredients:
+                ingredients[ingredient.id][1] += ingredient_recipe.amount
+            else:
+                ingredients[ingredient.id] = [
+                    ingredient.name,
+                    ingredient_recipe.amount,
+                    ingredient.measurement_unit,
+                ]
+    return ingredients
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare query count and latency of the shopping cart aggregation '
+        'with the legacy per-recipe loop. Seeded data is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', nargs='+', type=int, default=[10, 100, 1000],
+            help='Cart sizes (number of recipes) to benchmark.'
+        )
+        parser.add_argument(
+            '--per-recipe', type=int, default=10,
+            help='Ingredients per recipe.'
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--skip-legacy', action='store_true',
+            help='Do not run the legacy loop (slow for big carts).'
+        )
+
+    def handle(self, *args, **options):
+        rows = []
+        with rolled_back():
+            ingredient_ids = create_ingredients(500, prefix='bench-cart')
+            for size in options['sizes']:
+                user = create_user('bench-cart-{}'.format(size))
+                recipe_ids = create_recipes(
+                    user, size, ingredient_ids, options['per_recipe']
+                )
+                user.shopping_cart.set(recipe_ids)
+                analyze()
+
+                queries, latency = measure(
+                    lambda: list(get_shopping_cart_ingredients(user)),
+                    options['repeat']
+                )
+                row = [size, queries, '{:.1f}'.format(latency)]
+                if options['skip_legacy']:
+                    row += ['-', '-']
+                else:
+                    queries, latency = measure(
+                        lambda: legacy_shopping_cart(user),
+                        options['repeat']
+                    )
+                    row += [queries, '{:.1f}'.format(latency)]
+                rows.append(row)
+        print_table(
+            self.stdout,
+            ['recipes', 'queries', 'ms', 'legacy queries', 'legacy ms'],
+            rows
+        )
@@ -0,0 +1,109 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from api.caching import bump_generation
+from api.filters import RecipeFilter
+from recipes.models import Recipe, Tag
+from ._bench import (
+    analyze,
+    create_ingredients,
+    create_recipes,
+    create_user,
+    measure,
+    print_table,
+    rolled_back,
+)
+
+
+def join_filter(slugs):
+    """The join on tag slugs the filter used before, deduplicated."""
+    return Recipe.objects.filter(tags__slug__in=slugs).distinct()
+
+
+def exists_filter(slugs):
+    data = QueryDict(mutable=True)
+    data.setlist('tags', slugs)
+    return RecipeFilter(data, queryset=Recipe.objects.all()).qs
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare latency of the multi-tag recipe filter (EXISTS on the '
+        'through table) with a DISTINCT join on tag slugs. Seeded data is '
+        'rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--tags', type=int, default=16)
+        parser.add_argument(
+            '--selected', nargs='+', type=int, default=[1, 4, 12],
+            help='Numbers of tags passed to the filter.'
+        )
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        limit = options['limit']
+        rng = random.Random(0)
+        rows = []
+        with rolled_back():
+            Tag.objects.bulk_create(
+                Tag(
+                    name='bench-tag {}'.format(i),
+                    color='#b{:05x}'.format(i),
+                    slug='bench-tag-{}'.format(i),
+                )
+                for i in range(options['tags'])
+            )
+            tags = list(Tag.objects.filter(slug__startswith='bench-tag-'))
+            # bulk_create() skips the signals; the filter resolves slugs
+            # through the cached tag map.
+            bump_generation('tags')
+            author = create_user('bench-tags')
+            ingredient_ids = create_ingredients(20, prefix='bench-tags')
+            recipe_ids = create_recipes(
+                author, options['recipes'], ingredient_ids, per_recipe=2
+            )
+            Recipe.tags.through.objects.bulk_create(
+                (
+                    Recipe.tags.through(recipe_id=recipe_id, tag=tag)
+                    for recipe_id in recipe_ids
+                    for tag in rng.sample(tags, rng.randint(1, 3))
+                ),
+                batch_size=5000,
+            )
+            analyze()
+            for selected in options['selected']:
+                slugs = [tag.slug for tag in tags[:selected]]
+                for name, build in (
+                    ('join + distinct', join_filter),
+                    ('exists', exists_filter),
+                ):
+                    queryset = build(slugs).order_by('-id')
+                    queries, page_ms = measure(
+                        lambda: list(queryset.values_list(
+                            'id', flat=True
+                        )[:limit]),
+                        options['repeat']
+                    )
+                    _, count_ms = measure(
+                        lambda: queryset.count(), options['repeat']
+                    )
+                    rows.append([
+                        selected,
+                        name,
+                        queryset.count(),
+                        queries,
+                        '{:.1f}'.format(page_ms),
+                        '{:.1f}'.format(count_ms),
+                    ])
+        # Drop the cached tag map holding the rolled back tags.
+        bump_generation('tags')
+        print_table(
+            self.stdout,
+            ['tags', 'filter', 'matches', 'queries', 'page ms', 'count ms'],
+            rows
+        )
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
+
+from api.services import get_shopping_cart_ingredients
+from api.views import IngredientViewSet, RecipeViewset, SubscriptionList
+from recipes.models import Tag
+from users.models import User
+
+
+def view_queryset(view_class, user, params=None, action='list'):
+    """Filtered queryset a list view would paginate for ``user``."""
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    view = view_class(
+        request=request, action=action, format_kwarg=None, args=(), kwargs={}
+    )
+    return view.filter_queryset(view.get_queryset())
+
+
+class Command(BaseCommand):
+    help = (
+        'Print EXPLAIN plans of the main API queries to check which '
+        'indexes they use.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Email of the user to run the queries as (default: first).'
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Run EXPLAIN ANALYZE (PostgreSQL only).'
+        )
+
+    def get_user(self, email):
+        users = User.objects.order_by('id')
+        if email:
+            users = users.filter(email=email)
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to run the queries as.')
+        return user
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        page_size = api_settings.PAGE_SIZE
+        tag = Tag.objects.order_by('id').first()
+        querysets = {
+            'recipe list (anonymous)': (
+                view_queryset(RecipeViewset, AnonymousUser())[:page_size]
+            ),
+            'recipe list': view_queryset(RecipeViewset, user)[:page_size],
+            'recipe list by author': view_queryset(
+                RecipeViewset, user, {'author': user.pk}
+            )[:page_size],
+            'recipe list favorited': view_queryset(
+                RecipeViewset, user, {'is_favorited': 1}
+            )[:page_size],
+            'recipe list popular': view_queryset(
+                RecipeViewset, user, {'ordering': 'popular'}
+            )[:page_size],
+            'recipe list trending': view_queryset(
+                RecipeViewset, user, {'ordering': 'trending'}
+            )[:page_size],
+            'ingredient prefix search': view_queryset(
+                IngredientViewSet, user, {'name': 'мол'}
+            ),
+            'shopping cart': get_shopping_cart_ingredients(user),
+            'subscriptions': view_queryset(
+                SubscriptionList, user
+            )[:page_size],
+        }
+        if tag is not None:
+            querysets['recipe list by tag'] = view_queryset(
+                RecipeViewset, user, {'tags': tag.slug}
+            )[:page_size]
+
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        for name, queryset in querysets.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,371 @@
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+from ._bench import print_table
+
+# Sampled once from the database and shared by the workers.
+SAMPLE_SIZE = 5000
+
+
+def percentile(ordered, share):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return 0
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+class Fixtures:
+    """Ids, slugs and tokens the scenarios build their requests from."""
+
+    def __init__(self, rng, users, user_prefix):
+        self.recipe_ids = self.sample(rng, Recipe.objects)
+        self.user_ids = self.sample(rng, User.objects)
+        self.ingredient_ids = self.sample(rng, Ingredient.objects)
+        self.ingredient_prefixes = sorted({
+            name[:3] for name in Ingredient.objects.filter(
+                pk__in=self.ingredient_ids[:200]
+            ).values_list('name', flat=True)
+        })
+        self.tag_slugs = list(
+            Tag.objects.order_by('pk').values_list('slug', flat=True)
+        )
+        if not (self.recipe_ids and self.tag_slugs and self.ingredient_ids):
+            raise CommandError(
+                'The database is empty, run generate_dataset first.'
+            )
+        readers = (
+            User.objects.filter(username__startswith=user_prefix)
+            .order_by('pk')[:users]
+        )
+        tokens = {
+            user.pk: Token.objects.get_or_create(user=user)[0].key
+            for user in readers
+        }
+        self.tokens = list(tokens.values())
+        # token -> favorited recipe ids, so toggles always change state.
+        self.favorites = {token: set() for token in self.tokens}
+        for user_id, recipe_id in User.favorites.through.objects.filter(
+            user_id__in=tokens, recipe_id__in=self.recipe_ids
+        ).values_list('user_id', 'recipe_id'):
+            self.favorites[tokens[user_id]].add(recipe_id)
+        self.favorites_lock = threading.Lock()
+
+    @staticmethod
+    def sample(rng, queryset):
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+        return rng.sample(ids, min(len(ids), SAMPLE_SIZE))
+
+    def toggle_favorite(self, token, recipe_id):
+        """The method that flips the favorite, DELETE if it is set."""
+        with self.favorites_lock:
+            favorites = self.favorites[token]
+            if recipe_id in favorites:
+                favorites.remove(recipe_id)
+                return 'DELETE'
+            favorites.add(recipe_id)
+            return 'POST'
+
+
+def recipe_feed(rng, fixtures, token):
+    return 'GET', '/api/recipes/?' + urlencode({
+        'page': rng.choice((1, 1, 1, 2, 3, 10)), 'limit': 6
+    })
+
+
+def recipe_feed_by_tags(rng, fixtures, token):
+    tags = rng.sample(fixtures.tag_slugs, min(2, len(fixtures.tag_slugs)))
+    return 'GET', '/api/recipes/?' + urlencode(
+        [('tags', tag) for tag in tags] + [('limit', 6)]
+    )
+
+
+def recipe_search(rng, fixtures, token):
+    return 'GET', '/api/recipes/?' + urlencode({
+        'search': rng.choice(('суп', 'пирог', 'салат', 'томатный')),
+        'limit': 6,
+    })
+
+
+def recipe_detail(rng, fixtures, token):
+    return 'GET', '/api/recipes/{}/'.format(
+        rng.choice(fixtures.recipe_ids)
+    )
+
+
+def recipe_match(rng, fixtures, token):
+    return 'GET', '/api/recipes/match/?' + urlencode(
+        [
+            ('ingredients', pk)
+            for pk in rng.sample(
+                fixtures.ingredient_ids,
+                min(15, len(fixtures.ingredient_ids))
+            )
+        ] + [('missing', 3), ('limit', 6)]
+    )
+
+
+def ingredient_autocomplete(rng, fixtures, token):
+    return 'GET', '/api/ingredients/autocomplete/?' + urlencode({
+        'name': rng.choice(fixtures.ingredient_prefixes)
+    })
+
+
+def tag_list(rng, fixtures, token):
+    return 'GET', '/api/tags/'
+
+
+def user_profile(rng, fixtures, token):
+    return 'GET', '/api/users/{}/'.format(rng.choice(fixtures.user_ids))
+
+
+def favorites_feed(rng, fixtures, token):
+    return 'GET', '/api/recipes/?is_favorited=1&limit=6'
+
+
+def subscriptions(rng, fixtures, token):
+    return 'GET', '/api/users/subscriptions/?limit=6&recipes_limit=3'
+
+
+def shopping_cart(rng, fixtures, token):
+    return 'GET', '/api/recipes/download_shopping_cart/?format=txt'
+
+
+def favorite_toggle(rng, fixtures, token):
+    recipe_id = rng.choice(fixtures.recipe_ids)
+    return (
+        fixtures.toggle_favorite(token, recipe_id),
+        '/api/recipes/{}/favorite/'.format(recipe_id)
+    )
+
+
+# name, weight, authenticated, request builder (called with the token,
+# None if anonymous). Anonymous browsing dominates, as it does in
+# production.
+SCENARIOS = (
+    ('recipes', 30, False, recipe_feed),
+    ('recipes?tags', 10, False, recipe_feed_by_tags),
+    ('recipes?search', 6, False, recipe_search),
+    ('recipe', 15, False, recipe_detail),
+    ('recipes/match', 3, False, recipe_match),
+    ('ingredients/autocomplete', 8, False, ingredient_autocomplete),
+    ('tags', 4, False, tag_list),
+    ('user', 4, True, user_profile),
+    ('recipes?is_favorited', 6, True, favorites_feed),
+    ('subscriptions', 5, True, subscriptions),
+    ('download_shopping_cart', 2, True, shopping_cart),
+    ('favorite', 7, True, favorite_toggle),
+)
+
+
+def summarize(results, duration, scenarios=SCENARIOS):
+    """Latency percentiles in ms and throughput per endpoint and total."""
+    by_name = {}
+    for name, latency, ok in results:
+        by_name.setdefault(name, []).append((latency, ok))
+    by_name['total'] = [(latency, ok) for _, latency, ok in results]
+    order = [name for name, _, _, _ in scenarios] + ['total']
+    endpoints = {}
+    for name in sorted(by_name, key=order.index):
+        samples = by_name[name]
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, ok in samples if not ok),
+            'rps': len(samples) / duration,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
+    return {'endpoints': endpoints}
+
+
+def change(before, after):
+    if not before:
+        return '-'
+    return '{:+.0f}%'.format((after - before) / before * 100)
+
+
+class Worker(threading.Thread):
+    """Sends requests over one keep-alive connection until the deadline."""
+
+    def __init__(self, number, options, fixtures, scenarios, start, stop):
+        super().__init__(daemon=True)
+        self.rng = random.Random('{}:{}'.format(options['seed'], number))
+        self.url = urlsplit(options['url'])
+        self.timeout = options['timeout']
+        self.fixtures = fixtures
+        self.scenarios = scenarios
+        self.weights = [weight for _, weight, _, _ in scenarios]
+        self.measure_from = start
+        self.stop_at = stop
+        self.results = []
+        self.connection = None
+
+    def connect(self):
+        connection_class = (
+            http.client.HTTPSConnection if self.url.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(
+            self.url.netloc, timeout=self.timeout
+        )
+
+    def send(self, method, path, token):
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        if self.connection is None:
+            self.connect()
+        try:
+            self.connection.request(method, path, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None
+
+    def run(self):
+        while True:
+            now = time.perf_counter()
+            if now >= self.stop_at:
+                break
+            name, _, authenticated, build = self.rng.choices(
+                self.scenarios, self.weights
+            )[0]
+            token = (
+                self.rng.choice(self.fixtures.tokens) if authenticated
+                else None
+            )
+            method, path = build(self.rng, self.fixtures, token)
+            start = time.perf_counter()
+            status = self.send(method, path, token)
+            latency = time.perf_counter() - start
+            if start >= self.measure_from:
+                ok = status is not None and status < 400
+                self.results.append((name, latency, ok))
+        if self.connection is not None:
+            self.connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a weighted mix of API requests against a running server '
+        'from concurrent threads and report p50/p95/p99 latency and '
+        'throughput per endpoint. Use --output and --baseline to compare '
+        'runs. Requests are built from ids in this database, so point it '
+        'at the server using the same one, e.g. after generate_dataset.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--duration', type=float, default=30,
+            help='Seconds measured, after the warm-up.'
+        )
+        parser.add_argument('--warmup', type=float, default=5)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--users', type=int, default=200,
+            help='Users the authenticated requests are spread over.'
+        )
+        parser.add_argument('--user-prefix', default='load')
+        parser.add_argument(
+            '--only', nargs='+', metavar='SCENARIO',
+            choices=[name for name, _, _, _ in SCENARIOS],
+            help='Run just these scenarios.'
+        )
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Leave out the scenarios that need a token.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Write the results to this JSON file.'
+        )
+        parser.add_argument(
+            '--baseline', help='Compare with the JSON of an earlier run.'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if (not options['only'] or scenario[0] in options['only'])
+            and not (options['anonymous'] and scenario[2])
+        ]
+        fixtures = Fixtures(
+            random.Random(options['seed']),
+            options['users'],
+            options['user_prefix'],
+        )
+        if not fixtures.tokens and any(scenario[2] for scenario in scenarios):
+            raise CommandError(
+                'No users named {}*: pass --user-prefix or --anonymous.'
+                .format(options['user_prefix'])
+            )
+        start = time.perf_counter() + options['warmup']
+        stop = start + options['duration']
+        workers = [
+            Worker(number, options, fixtures, scenarios, start, stop)
+            for number in range(options['concurrency'])
+        ]
+        self.stdout.write('{} threads against {} for {:.0f} s'.format(
+            len(workers), options['url'],
+            options['warmup'] + options['duration']
+        ))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        results = summarize(
+            [result for worker in workers for result in worker.results],
+            options['duration'],
+        )
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['endpoints']
+        header = ['endpoint', 'requests', 'errors', 'rps', 'p50 ms',
+                  'p95 ms', 'p99 ms']
+        if baseline:
+            header += ['p95 vs base', 'rps vs base']
+        rows = []
+        for name, stats in results['endpoints'].items():
+            row = [
+                name, stats['requests'], stats['errors'],
+                '{:.1f}'.format(stats['rps']),
+                '{:.1f}'.format(stats['p50']),
+                '{:.1f}'.format(stats['p95']),
+                '{:.1f}'.format(stats['p99']),
+            ]
+            if baseline:
+                before = baseline.get(name)
+                row += [
+                    change(before and before['p95'], stats['p95']),
+                    change(before and before['rps'], stats['rps']),
+                ]
+            rows.append(row)
+        print_table(self.stdout, header, rows)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    dict(results, options={
+                        key: options[key] for key in (
+                            'url', 'concurrency', 'duration', 'users',
+                            'only', 'anonymous', 'seed'
+                        )
+                    }),
+                    file, ensure_ascii=False, indent=2
+                )
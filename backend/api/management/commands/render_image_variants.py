@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.images import create_variants, needs_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the resized image variants of recipes that have none for '
+        'their current image, e.g. after IMAGE_VARIANTS changed or for '
+        'images uploaded before the variants existed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Render the variants of every recipe again.'
+        )
+
+    def handle(self, *args, **options):
+        rendered = failed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'pk', 'image', 'image_variants'
+        )
+        for recipe in recipes.iterator():
+            if not (options['all'] or needs_variants(recipe)):
+                continue
+            try:
+                create_variants(recipe.pk)
+            except Exception as error:
+                failed += 1
+                self.stderr.write('Recipe {}: {}'.format(recipe.pk, error))
+            else:
+                rendered += 1
+        self.stdout.write(self.style.SUCCESS(
+            '{} recipes rendered, {} failed'.format(rendered, failed)
+        ))
@@ -0,0 +1,153 @@
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from recipes.models import IngredientRecipe
+from .caching import advance_generation, get_cache, get_generation
+
+GENERATION = 'recipe-ingredients'
+# Changes a process may replay before it rebuilds the index instead.
+JOURNAL_SIZE = 1000
+JOURNAL_TIMEOUT = 24 * 60 * 60
+
+
+def _change_key(generation):
+    return '{}:changes:{}'.format(GENERATION, generation)
+
+
+def record_recipe_changes(recipe_ids):
+    """
+    Publish recipes whose ingredients changed, so that every process
+    updates its index with just these recipes.
+    """
+    generation = advance_generation(GENERATION)
+    if generation is not None:
+        get_cache().set(
+            _change_key(generation),
+            list(recipe_ids),
+            timeout=JOURNAL_TIMEOUT
+        )
+
+
+class RecipeIngredientIndex:
+    """
+    In-memory inverted index from ingredient ids to the recipes using
+    them, for "what can I cook" matching.
+
+    Each posting list is a sorted ``array`` of recipe ids. Matching counts,
+    for every recipe, how many of the given ingredients it uses, so it
+    only walks the posting lists of those ingredients.
+
+    The index follows the ``recipe-ingredients`` generation. Every change
+    steps the generation by one and leaves the changed recipe ids under
+    the new token, which processes replay to update just those recipes.
+    The index is rebuilt when the journal has a gap or is too long.
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.postings = {}
+        self.recipes = {}
+        self.lock = threading.Lock()
+
+    def build(self, rows):
+        """Index ``(recipe_id, ingredient_id)`` rows."""
+        postings = defaultdict(list)
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        self.postings = {
+            ingredient_id: array('q', sorted(recipe_ids))
+            for ingredient_id, recipe_ids in postings.items()
+        }
+        self.recipes = {
+            recipe_id: tuple(ingredient_ids)
+            for recipe_id, ingredient_ids in recipes.items()
+        }
+
+    def update(self, recipe_ids, rows):
+        """
+        Replace the ingredients of ``recipe_ids`` with ``rows``; recipes
+        without rows are dropped.
+        """
+        for recipe_id in recipe_ids:
+            for ingredient_id in self.recipes.pop(recipe_id, ()):
+                posting = self.postings[ingredient_id]
+                position = bisect_left(posting, recipe_id)
+                if position < len(posting) and posting[position] == recipe_id:
+                    del posting[position]
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            insort(
+                self.postings.setdefault(ingredient_id, array('q')),
+                recipe_id
+            )
+            recipes[recipe_id].append(ingredient_id)
+        for recipe_id, ingredient_ids in recipes.items():
+            self.recipes[recipe_id] = tuple(ingredient_ids)
+
+    def refresh(self):
+        generation = get_generation(GENERATION)
+        if generation == self.generation:
+            return
+        with self.lock:
+            if generation == self.generation:
+                return
+            if not self.replay(generation):
+                self.build(
+                    IngredientRecipe.objects
+                    .values_list('recipe_id', 'ingredient_id')
+                    .iterator()
+                )
+            self.generation = generation
+
+    def replay(self, generation):
+        """Apply the journal up to ``generation``, False if it has gaps."""
+        if self.generation is None:
+            return False
+        missed = generation - self.generation
+        if not 0 < missed <= JOURNAL_SIZE:
+            return False
+        keys = [
+            _change_key(self.generation + step)
+            for step in range(1, missed + 1)
+        ]
+        changes = get_cache().get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        recipe_ids = set()
+        for ids in changes.values():
+            recipe_ids.update(ids)
+        self.update(
+            recipe_ids,
+            IngredientRecipe.objects
+            .filter(recipe_id__in=recipe_ids)
+            .values_list('recipe_id', 'ingredient_id')
+        )
+        return True
+
+    def match(self, ingredient_ids, missing=0):
+        """
+        Recipes using at least one of ``ingredient_ids`` and needing at
+        most ``missing`` others, as ``(recipe_id, matched, missing)``.
+        Recipes with the larger share of their ingredients at hand come
+        first, then those matching more ingredients, then newer ones.
+        """
+        with self.lock:
+            counts = Counter()
+            for ingredient_id in set(ingredient_ids):
+                counts.update(self.postings.get(ingredient_id, ()))
+            found = []
+            for recipe_id, matched in counts.items():
+                lacking = len(self.recipes[recipe_id]) - matched
+                if lacking <= missing:
+                    found.append((recipe_id, matched, lacking))
+        found.sort(key=lambda row: (
+            -row[1] / (row[1] + row[2]), -row[1], -row[0]
+        ))
+        return found
+
+
+recipe_index = RecipeIngredientIndex()
@@ -0,0 +1,295 @@
+"""
+Per-request performance metrics.
+
+A sample of requests (METRICS_SAMPLE_RATE) is timed end to end, with the
+time spent in serializers and in SQL and the number of queries. Queries
+are grouped by statement shape; a shape repeated METRICS_DUPLICATE_QUERIES
+times or more in one request is counted as a likely N+1. Samples feed
+per-view histograms kept in process memory, exported in the Prometheus
+text format by ``metrics_view``, and are summed up in a ``Server-Timing``
+header of the sampled response.
+
+Every worker process keeps its own histograms, so a scrape sees the
+process that served it.
+"""
+import ipaddress
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.serializers import BaseSerializer
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = ContextVar('request_sample', default=None)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST = re.compile(r'(?:%s|\?)(?:\s*,\s*(?:%s|\?))+')
+
+
+def normalize_sql(sql):
+    """
+    Shape of a statement: literals and placeholders become ``?`` and
+    lists of them one ``?``, so ``IN`` lists of any length match.
+    """
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = PLACEHOLDER_LIST.sub('?', sql)
+    return sql.replace('%s', '?')
+
+
+def view_name(request):
+    """``RecipeViewset.list``, ``GetShoppingCart`` and so on."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    view_class = getattr(func, 'cls', None) or getattr(
+        func, 'view_class', None
+    )
+    if view_class is None:
+        return getattr(func, '__name__', type(func).__name__)
+    action = (getattr(func, 'actions', None) or {}).get(
+        request.method.lower()
+    )
+    if action is None:
+        return view_class.__name__
+    return '{}.{}'.format(view_class.__name__, action)
+
+
+class RequestSample:
+    """What one sampled request spent its time on."""
+
+    def __init__(self):
+        self.queries = []
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.sql_time += duration
+            self.queries.append((sql, duration))
+
+    def duplicate_shapes(self, threshold):
+        """Statement shapes run at least ``threshold`` times."""
+        shapes = Counter(normalize_sql(sql) for sql, _ in self.queries)
+        return {
+            shape: count
+            for shape, count in shapes.items()
+            if count >= threshold
+        }
+
+
+def current_sample():
+    return _current.get()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, cumulative
+            )
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.serializer = Histogram(DURATION_BUCKETS)
+        self.sql = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.n_plus_one = 0
+
+
+class Registry:
+    """Histograms per view, safe to update from several threads."""
+    HISTOGRAMS = (
+        (
+            'duration', 'foodgram_request_duration_seconds',
+            'Wall time of sampled requests.'
+        ),
+        (
+            'serializer', 'foodgram_serializer_duration_seconds',
+            'Time spent producing serializer data.'
+        ),
+        (
+            'sql', 'foodgram_sql_duration_seconds',
+            'Time spent in SQL queries.'
+        ),
+        (
+            'queries', 'foodgram_sql_queries',
+            'SQL queries per request.'
+        ),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def clear(self):
+        with self.lock:
+            self.views = {}
+
+    def observe(self, view, duration, sample, n_plus_one):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.duration.observe(duration)
+            metrics.serializer.observe(sample.serializer_time)
+            metrics.sql.observe(sample.sql_time)
+            metrics.queries.observe(len(sample.queries))
+            metrics.n_plus_one += n_plus_one
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format."""
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = []
+            for attribute, name, description in self.HISTOGRAMS:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for view, metrics in views:
+                    lines.extend(getattr(metrics, attribute).render(
+                        name, 'view="{}"'.format(view)
+                    ))
+            name = 'foodgram_n_plus_one_total'
+            lines.append(
+                '# HELP {} Sampled requests that repeated a statement '
+                'shape METRICS_DUPLICATE_QUERIES times.'.format(name)
+            )
+            lines.append('# TYPE {} counter'.format(name))
+            for view, metrics in views:
+                lines.append('{}{{view="{}"}} {}'.format(
+                    name, view, metrics.n_plus_one
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def instrument_serializers():
+    """
+    Time ``serializer.data`` of sampled requests. Only the outermost call
+    counts, nested serializers run inside it.
+    """
+    original = BaseSerializer.data
+
+    def data(self):
+        if not settings.METRICS_SAMPLE_RATE:
+            return original.fget(self)
+        sample = _current.get()
+        if sample is None or sample.serializer_depth:
+            return original.fget(self)
+        sample.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            sample.serializer_time += time.perf_counter() - start
+            sample.serializer_depth -= 1
+
+    BaseSerializer.data = property(data)
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure a METRICS_SAMPLE_RATE share of requests. Goes first in
+    MIDDLEWARE, so the wall time covers the rest of the stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        sample = RequestSample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+        duplicates = sample.duplicate_shapes(
+            settings.METRICS_DUPLICATE_QUERIES
+        )
+        registry.observe(
+            view_name(request), duration, sample, 1 if duplicates else 0
+        )
+        response['Server-Timing'] = (
+            'db;dur={:.1f};desc="{} queries", serializer;dur={:.1f}, '
+            'total;dur={:.1f}'.format(
+                sample.sql_time * 1000,
+                len(sample.queries),
+                sample.serializer_time * 1000,
+                duration * 1000,
+            )
+        )
+        return response
+
+
+def is_metrics_client(address):
+    """Whether ``address`` is in one of the METRICS_ALLOWED_IPS networks."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape target. nginx does not route /metrics, and the
+    backend answers it only to METRICS_ALLOWED_IPS, as its own port may be
+    reachable too. REMOTE_ADDR is checked, never a forwarded header.
+    """
+    if not is_metrics_client(request.META.get('REMOTE_ADDR', '')):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
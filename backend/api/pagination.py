@@ -3,3 +3,65 @@ from rest_framework import pagination
 
 class PageNumberAndLimitPagination(pagination.PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Keyset pagination over ``id`` with opaque cursors. Pages cost the same
+    however deep they are and no ``COUNT(*)`` is run.
+    """
+    ordering = '-id'
+    page_size_query_param = 'limit'
+
+    def get_ordering(self, request, queryset, view):
+        # Ranked feeds (popularity, search relevance) page by their rank
+        # and keep the tie-breaker of the filter that ranked them.
+        if queryset.query.order_by[:1] == ('-rank',):
+            return tuple(queryset.query.order_by)
+        return super().get_ordering(request, queryset, view)
+
+
+class PageNumberOrKeysetPagination(pagination.BasePagination):
+    """
+    Page number pagination unless the request has a ``cursor`` parameter,
+    which switches to keyset pagination. An empty ``cursor`` asks for the
+    first page; later pages follow the ``next`` links.
+    """
+    page_number_class = PageNumberAndLimitPagination
+    keyset_class = KeysetPagination
+
+    def __init__(self):
+        self.paginator = self.page_number_class()
+
+    @property
+    def display_page_controls(self):
+        return self.paginator.display_page_controls
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_class()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.paginator.get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
+
+    def get_schema_fields(self, view):
+        return (
+            self.page_number_class().get_schema_fields(view)
+            + self.keyset_class().get_schema_fields(view)[:1]
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.page_number_class().get_schema_operation_parameters(view)
+            + self.keyset_class().get_schema_operation_parameters(view)[:1]
+        )
@@ -1,21 +1,82 @@
-import base64
-
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserSerializer
-from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 
 from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
 from users.models import User
+from . import images
+
+RECIPES_LIMIT = 5
+
+
+def get_recipes_limit(request):
+    """Number of recipes to preview per author in subscriptions."""
+    try:
+        return max(int(request.query_params['recipes_limit']), 0)
+    except (KeyError, ValueError):
+        return RECIPES_LIMIT
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Image from a base64 data URI or an upload, checked against the size
+    and dimension limits and named after its content (see api.images).
+    """
+    default_error_messages = {
+        'too_large': (
+            'Изображение должно быть не больше {max_mb} МБ '
+            'и {max_megapixels} Мп.'
+        ),
+    }
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        max_bytes = settings.IMAGE_MAX_BYTES
+        try:
+            if isinstance(data, str) and data.startswith('data:image'):
+                start = data.find(';base64,', 0, 100)
+                if start == -1:
+                    self.fail('invalid_image')
+                file, digest = images.spool_base64(
+                    data, start + len(';base64,'), max_bytes
+                )
+            elif hasattr(data, 'chunks'):
+                file, digest = images.spool_upload(data, max_bytes)
+            else:
+                self.fail('invalid')
+            image_format = images.inspect_image(file)
+        except images.ImageTooLarge:
+            self.fail(
+                'too_large',
+                max_mb=max_bytes // (1024 * 1024),
+                max_megapixels=settings.IMAGE_MAX_PIXELS // 1000 ** 2,
+            )
+        except ValueError:
+            self.fail('invalid_image')
+        file = images.hashed_file(file, digest, image_format)
+        if isinstance(file, str):
+            return file
+        # Pillow has checked the image already.
+        return serializers.FileField.to_internal_value(self, file)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
+
+
+class RecipeMatchSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_IDS,
+    )
+    missing = serializers.IntegerField(min_value=0, default=0)
 
 
 class CustomUserSerializer(UserSerializer):
@@ -33,6 +94,8 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request:
             user = request.user
@@ -119,6 +182,7 @@ class AnonymousRecipeSerializer(serializers.ModelSerializer):
     author = AnonymousUserSerializer(many=False, required=False)
     ingredients = IngredientRecipeSerializer(many=True)
     cooking_time = serializers.IntegerField(min_value=1)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -129,10 +193,29 @@ class AnonymousRecipeSerializer(serializers.ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         )
 
+    def get_image_variants(self, obj):
+        """
+        URLs of the resized copies as ``{variant: {format: url}}``, empty
+        until they are rendered for the current image.
+        """
+        if images.needs_variants(obj) or not obj.image:
+            return {}
+        request = self.context.get('request')
+        variants = {}
+        for variant, files in obj.image_variants['files'].items():
+            variants[variant] = {}
+            for image_format, path in files.items():
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                variants[variant][image_format] = url
+        return variants
+
 
 class ListRetrieveRecipeSerializer(AnonymousRecipeSerializer):
     author = CustomUserSerializer(many=False, required=False)
@@ -151,6 +234,7 @@ class ListRetrieveRecipeSerializer(AnonymousRecipeSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         )
@@ -162,78 +246,108 @@ class ListRetrieveRecipeSerializer(AnonymousRecipeSerializer):
         return None
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.get_current_user()
         return user.favorites.filter(pk=obj.pk).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.get_current_user()
         return user.shopping_cart.filter(pk=obj.pk).exists()
 
 
+class IngredientAmountSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
 class RecipeCreateUpdateSerializer(ListRetrieveRecipeSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-        allow_null=True
-    )
-    ingredients = IngredientRecipeSerializer(
-        many=True,
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
+    ingredients = IngredientAmountSerializer(many=True)
+
+    def validate_tags(self, value):
+        """Load the tags in one query, not one per id."""
+        found = Tag.objects.in_bulk(value)
+        missing = [pk for pk in value if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                'Теги не найдены: {}'.format(', '.join(map(str, missing)))
+            )
+        return [found[pk] for pk in dict.fromkeys(value)]
 
-    def create(self, validated_data):
-        non_val_ingredients = self.context['request'].data['ingredients']
-        validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        ingredient_recipe = []
-        for ingredient in non_val_ingredients:
-            ingredient_obj = get_object_or_404(
-                Ingredient,
-                pk=ingredient.get('id')
+    def validate_ingredients(self, value):
+        ids = [item['id'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться'
             )
-            ingredient_recipe.append(
-                IngredientRecipe(
-                    ingredient=ingredient_obj,
-                    recipe=recipe,
-                    amount=ingredient['amount']
+        found = Ingredient.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}'.format(
+                    ', '.join(map(str, missing))
                 )
             )
-        IngredientRecipe.objects.bulk_create(
-                ingredient_recipe,
-                ignore_conflicts=True
-            )
+        return value
+
+    def set_ingredients(self, recipe, ingredients, created=False):
+        """
+        Bring the recipe's ingredient rows in line with ``ingredients``,
+        writing only the rows that were added, changed or removed.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        existing = {} if created else {
+            row.ingredient_id: row for row in recipe.ingredients.all()
+        }
+        removed = [
+            row.pk for pk, row in existing.items() if pk not in amounts
+        ]
+        changed = []
+        for pk, row in existing.items():
+            if pk in amounts and row.amount != amounts[pk]:
+                row.amount = amounts[pk]
+                changed.append(row)
+        added = [
+            IngredientRecipe(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in amounts.items()
+            if pk not in existing
+        ]
+        if removed:
+            IngredientRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientRecipe.objects.bulk_create(added)
+
+    @transaction.atomic
+    def create(self, validated_data):
+        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
+        recipe = Recipe.objects.create(**validated_data)
+        self.set_ingredients(recipe, ingredients, created=True)
         recipe.tags.set(tags)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        recipe = instance
-        if self.context['request'].data.get('ingredients') is not None:
-            non_val_ingredients = self.context['request'].data['ingredients']
-            validated_data.pop('ingredients')
-            recipe.ingredients.all().delete()
-            ingredient_recipe = []
-            for ingredient in non_val_ingredients:
-                ingredient_obj = get_object_or_404(
-                    Ingredient,
-                    pk=ingredient.get('id')
-                )
-                ingredient_recipe.append(
-                    IngredientRecipe(
-                        ingredient=ingredient_obj,
-                        recipe=recipe,
-                        amount=ingredient['amount']
-                    )
-                )
-            IngredientRecipe.objects.bulk_create(
-                    ingredient_recipe,
-                    ignore_conflicts=True
-                )
-        if self.context['request'].data.get('tags') is not None:
-            tags = validated_data.pop('tags')
-            recipe.tags.set(tags)
+        if 'ingredients' in validated_data:
+            self.set_ingredients(instance, validated_data.pop('ingredients'))
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.pop('tags'))
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'ingredients',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
         serializer = ListRetrieveRecipeSerializer(
             instance,
             context={'request': self.context['request']}
@@ -253,7 +367,6 @@ class RecipeCreateUpdateSerializer(ListRetrieveRecipeSerializer):
             'cooking_time'
         )
         read_only_fields = ('author',)
-        extra_kwargs = {"ingredients": {"required": False, "allow_null": True}}
 
 
 class SimpleRecipeSerializer(ListRetrieveRecipeSerializer):
@@ -262,6 +375,7 @@ class SimpleRecipeSerializer(ListRetrieveRecipeSerializer):
         fields = (
             'id',
             'image',
+            'image_variants',
             'name',
             'cooking_time'
         )
@@ -269,7 +383,6 @@ class SimpleRecipeSerializer(ListRetrieveRecipeSerializer):
 
 class SubscriptionsSerializer(CustomUserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -285,14 +398,10 @@ class SubscriptionsSerializer(CustomUserSerializer):
         )
 
     def get_recipes(self, obj):
-        recipes_limit = self.context['request'].GET.get('recipes_limit')
-        if recipes_limit is None:
-            recipes_limit = 5
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
         else:
-            recipes_limit = int(recipes_limit)
-        recipes = obj.recipes.all()[:recipes_limit]
+            recipes = obj.recipes.all()[
+                :get_recipes_limit(self.context['request'])
+            ]
         return SimpleRecipeSerializer(recipes, many=True).data
-
-    def get_recipes_count(self, obj):
-        recipes_number = obj.recipes.all().count()
-        return recipes_number
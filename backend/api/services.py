@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.signals import m2m_changed
+
+from recipes.models import IngredientRecipe
+
+
+def get_shopping_cart_ingredients(user):
+    """
+    Total amount of every ingredient across the recipes in the user's
+    shopping cart, grouped by ingredient and computed in a single query.
+
+    Each row is a dict with ``ingredient_id``, ``name``,
+    ``measurement_unit`` and ``amount`` keys.
+    """
+    return (
+        IngredientRecipe.objects
+        .filter(recipe__shoppers=user)
+        .values(
+            'ingredient_id',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        )
+        .annotate(amount=Sum('amount'))
+        .order_by('name', 'measurement_unit')
+    )
+
+
+def add_related(manager, ids, exclude=()):
+    """
+    Link the manager's instance to the objects with the given ids in one
+    ``bulk_create`` on the through table.
+
+    ``m2m_changed`` is sent with exactly the ids that were linked, as
+    ``manager.add()`` would. Returns ``(added, existing, invalid)`` sets,
+    where ``invalid`` holds unknown and excluded ids.
+    """
+    ids = set(ids)
+    through = manager.through
+    source = manager.source_field_name
+    target = manager.target_field_name
+    found = set(
+        manager.model.objects
+        .filter(pk__in=ids - set(exclude))
+        .values_list('pk', flat=True)
+    )
+    existing = set(
+        through.objects
+        .filter(**{source: manager.instance, target + '__in': found})
+        .values_list(target + '_id', flat=True)
+    )
+    added = found - existing
+    if added:
+        with transaction.atomic():
+            _send_m2m_changed(manager, 'pre_add', added)
+            through.objects.bulk_create(
+                (
+                    through(**{
+                        source + '_id': manager.instance.pk,
+                        target + '_id': pk,
+                    })
+                    for pk in added
+                ),
+                ignore_conflicts=True,
+            )
+            _send_m2m_changed(manager, 'post_add', added)
+    return added, existing, ids - found
+
+
+def remove_related(manager, ids):
+    """
+    Unlink the objects with the given ids and return the set of ids that
+    were actually linked. ``m2m_changed`` gets exactly that set.
+    """
+    target = manager.target_field_name
+    links = manager.through.objects.filter(**{
+        manager.source_field_name: manager.instance,
+        target + '__in': set(ids),
+    })
+    with transaction.atomic():
+        removed = set(links.values_list(target + '_id', flat=True))
+        if removed:
+            _send_m2m_changed(manager, 'pre_remove', removed)
+            links.delete()
+            _send_m2m_changed(manager, 'post_remove', removed)
+    return removed
+
+
+def _send_m2m_changed(manager, action, pk_set):
+    m2m_changed.send(
+        sender=manager.through,
+        instance=manager.instance,
+        action=action,
+        reverse=False,
+        model=manager.model,
+        pk_set=pk_set,
+        using=manager.db,
+    )
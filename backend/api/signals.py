@@ -0,0 +1,60 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import User
+from .caching import bump_generation
+from .images import needs_variants, schedule_variants
+from .matching import record_recipe_changes
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    transaction.on_commit(partial(bump_generation, 'tags'))
+    transaction.on_commit(partial(bump_generation, 'recipes'))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    transaction.on_commit(partial(bump_generation, 'ingredients'))
+    transaction.on_commit(partial(bump_generation, 'recipes'))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipes(**kwargs):
+    # Ingredient and tag links are written along with the recipe itself.
+    transaction.on_commit(partial(bump_generation, 'recipes'))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_authors(update_fields=None, **kwargs):
+    """Recipes embed their author; logins only touch ``last_login``."""
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        transaction.on_commit(partial(bump_generation, 'recipes'))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def journal_recipe_ingredients(instance, **kwargs):
+    # After commit, once the write path has stored the ingredients too.
+    transaction.on_commit(partial(record_recipe_changes, [instance.pk]))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def journal_deleted_ingredient_recipes(instance, **kwargs):
+    # Collected now: the cascade deletes the links before the commit.
+    recipe_ids = list(
+        IngredientRecipe.objects
+        .filter(ingredient=instance)
+        .values_list('recipe_id', flat=True)
+    )
+    if recipe_ids:
+        transaction.on_commit(partial(record_recipe_changes, recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def render_image_variants(instance, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(partial(schedule_variants, instance.pk))
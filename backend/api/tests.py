@@ -1,3 +1,1158 @@
-from django.test import TestCase
+"""
+Query budgets for every API route.
 
-# Create your tests here.
+Each test seeds a realistic dataset and fails when an endpoint issues more
+SQL queries than its budget allows. List endpoints are requested with a
+small and a large page and must cost the same, so an N+1 shows up even if
+the budget itself is generous. Run on SQLite with::
+
+    DB_ENGINE=django.db.backends.sqlite3 python manage.py test
+"""
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from http import HTTPStatus
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api import checks, detectors, exporters, images, metrics
+from api.caching import get_cache
+from api.serializers import IngredientRecipeSerializer
+from recipes.management.commands.update_recipe_scores import (
+    update_recipe_scores
+)
+from recipes.models import (
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeActivity,
+    Tag
+)
+from recipes.search import update_search_documents
+from users.models import User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+IMAGE = (
+    'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAA'
+    'AIBRAA7'
+)
+IMAGE_BYTES = base64.b64decode(IMAGE.partition(',')[2])
+
+SMALL_PAGE = 2
+LARGE_PAGE = 20
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_WORKERS=0,
+    QUERY_DETECTOR_SAMPLE_RATE=1,
+    QUERY_DETECTOR_STRICT=True,
+)
+class QueryBudgetTestCase(APITestCase):
+    PASSWORD = 'Secret-pass-42'
+
+    @classmethod
+    def setUpTestData(cls):
+        images = os.path.join(MEDIA_ROOT, 'recipes', 'images')
+        os.makedirs(images, exist_ok=True)
+        with open(os.path.join(images, 'test.gif'), 'wb') as file:
+            file.write(IMAGE_BYTES)
+        cls.tags = [
+            Tag.objects.create(
+                name='Тег {}'.format(i),
+                color='#00000{}'.format(i),
+                slug='tag{}'.format(i)
+            )
+            for i in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name='ингредиент {}'.format(i),
+                measurement_unit='г'
+            )
+            for i in range(30)
+        ]
+        cls.reader = cls.create_user('reader')
+        cls.authors = [
+            cls.create_user('author{}'.format(i)) for i in range(3)
+        ]
+        cls.reader.following.set(cls.authors)
+        cls.recipes = []
+        for number in range(24):
+            recipe = Recipe.objects.create(
+                name='Рецепт {}'.format(number),
+                author=cls.authors[number % len(cls.authors)],
+                image='recipes/images/test.gif',
+                text='Описание',
+                cooking_time=10 + number,
+            )
+            recipe.tags.set(cls.tags[number % 3:number % 3 + 2])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe,
+                    ingredient=cls.ingredients[(number + step) % 30],
+                    amount=step + 1
+                )
+                for step in range(5)
+            )
+            cls.recipes.append(recipe)
+        cls.reader.favorites.set(cls.recipes[::2])
+        cls.reader.shopping_cart.set(cls.recipes[::3])
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.author_token = Token.objects.create(user=cls.authors[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        get_cache().clear()
+
+    @classmethod
+    def create_user(cls, username):
+        user = User.objects.create(
+            username=username,
+            email='{}@foodgram.test'.format(username),
+            first_name=username.capitalize(),
+            last_name='Test',
+        )
+        user.set_password(cls.PASSWORD)
+        user.save()
+        return user
+
+    def authenticate(self, token=None):
+        token = token or self.token
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def assertMaxQueries(self, budget, method, url, data=None,
+                         status=HTTPStatus.OK):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(
+            response.status_code, status, getattr(response, 'data', None)
+        )
+        self.assertLessEqual(
+            len(context),
+            budget,
+            '{} {} ran {} queries, budget is {}:\n{}'.format(
+                method.upper(),
+                url,
+                len(context),
+                budget,
+                '\n'.join(query['sql'] for query in context.captured_queries)
+            )
+        )
+        return len(context)
+
+    def assertPageQueries(self, budget, url):
+        """Both a small and a large page must fit the same budget."""
+        separator = '&' if '?' in url else '?'
+        counts = [
+            self.assertMaxQueries(
+                budget, 'get', '{}{}limit={}'.format(url, separator, size)
+            )
+            for size in (SMALL_PAGE, LARGE_PAGE)
+        ]
+        self.assertEqual(
+            counts[0], counts[1], '{} depends on page size'.format(url)
+        )
+
+
+class RecipeQueryBudgetTests(QueryBudgetTestCase):
+    def test_list_anonymous(self):
+        self.assertPageQueries(5, '/api/recipes/')
+
+    def test_list(self):
+        self.authenticate()
+        self.assertPageQueries(6, '/api/recipes/')
+
+    def test_list_keyset(self):
+        self.authenticate()
+        self.assertPageQueries(5, '/api/recipes/?cursor=')
+        response = self.client.get('/api/recipes/', {'cursor': '', 'limit': 5})
+        page = response.json()
+        self.assertNotIn('count', page)
+        self.assertEqual(
+            [recipe['id'] for recipe in page['results']],
+            [recipe.pk for recipe in self.recipes[::-1][:5]]
+        )
+        self.assertMaxQueries(5, 'get', page['next'])
+
+    def test_list_filtered(self):
+        self.authenticate()
+        self.assertPageQueries(7, '/api/recipes/?author={}'.format(
+            self.authors[0].pk
+        ))
+        # A cold cache costs one more query to load the tag slug map.
+        self.assertMaxQueries(7, 'get', '/api/recipes/?tags=tag1')
+        for query in (
+            'is_favorited=1',
+            'is_in_shopping_cart=1',
+            'tags=tag1',
+            'tags=tag0&tags=tag1&tags=tag2',
+            'ordering=popular',
+            'ordering=trending',
+        ):
+            with self.subTest(query=query):
+                self.assertPageQueries(6, '/api/recipes/?' + query)
+
+    def test_tags(self):
+        # Recipes tagged tag0 and tag1 or tag1 and tag2, each listed once.
+        expected = [
+            recipe.pk
+            for number, recipe in enumerate(self.recipes)
+            if number % 3 < 2
+        ][::-1]
+        response = self.client.get(
+            '/api/recipes/',
+            {'tags': ['TAG0', 'tag1', 'missing'], 'limit': LARGE_PAGE}
+        )
+        page = response.json()
+        self.assertEqual(page['count'], len(expected))
+        self.assertEqual(
+            [recipe['id'] for recipe in page['results']],
+            expected[:LARGE_PAGE]
+        )
+        response = self.client.get('/api/recipes/', {'tags': 'missing'})
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_popular(self):
+        update_recipe_scores()
+        # Favorited and in the cart: recipes[::6], newest first.
+        expected = [recipe.pk for recipe in self.recipes[::6]][::-1]
+        response = self.client.get(
+            '/api/recipes/', {'ordering': 'popular', 'limit': 4}
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            expected
+        )
+        response = self.client.get(
+            '/api/recipes/',
+            {'ordering': 'popular', 'limit': 2, 'cursor': ''}
+        )
+        page = response.json()
+        response = self.client.get(page['next'])
+        self.assertEqual(
+            [recipe['id'] for recipe in page['results']]
+            + [recipe['id'] for recipe in response.json()['results']],
+            expected
+        )
+
+    def test_trending(self):
+        RecipeActivity.objects.all().delete()
+        old, new = self.recipes[1], self.recipes[2]
+        week_ago = timezone.now() - timedelta(days=7)
+        RecipeActivity.objects.bulk_create(
+            [
+                RecipeActivity(
+                    recipe=old,
+                    kind=RecipeActivity.SHOPPING_CART,
+                    added=True,
+                    created=week_ago,
+                )
+            ] * 3
+            + [
+                RecipeActivity(
+                    recipe=new,
+                    kind=RecipeActivity.SHOPPING_CART,
+                    added=True
+                )
+            ]
+        )
+        update_recipe_scores()
+        response = self.client.get(
+            '/api/recipes/', {'ordering': 'trending', 'limit': 2}
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [new.pk, old.pk]
+        )
+
+    def test_retrieve(self):
+        self.authenticate()
+        # One more for the version behind the ETag.
+        self.assertMaxQueries(
+            6, 'get', '/api/recipes/{}/'.format(self.recipes[0].pk)
+        )
+
+    def test_create(self):
+        self.authenticate()
+        data = {
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10}
+                for ingredient in self.ingredients
+            ],
+            'tags': [tag.pk for tag in self.tags],
+            'image': IMAGE,
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+        }
+        self.assertMaxQueries(
+            18, 'post', '/api/recipes/', data, status=HTTPStatus.CREATED
+        )
+
+    def test_update(self):
+        self.authenticate(self.author_token)
+        recipe = self.recipes[0]
+        current = list(recipe.ingredients.values_list('ingredient', flat=True))
+        # Keeps one row, changes one, removes the rest and adds 25.
+        amounts = {current[0]: 1, current[1]: 20}
+        amounts.update({
+            ingredient.pk: 30
+            for ingredient in self.ingredients if ingredient.pk not in current
+        })
+        data = {
+            'ingredients': [
+                {'id': pk, 'amount': amount} for pk, amount in amounts.items()
+            ],
+            'tags': [self.tags[0].pk],
+            'name': 'Обновлённый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+        }
+        self.assertMaxQueries(
+            17, 'patch', '/api/recipes/{}/'.format(recipe.pk), data
+        )
+        self.assertEqual(
+            dict(recipe.ingredients.values_list('ingredient', 'amount')),
+            amounts
+        )
+
+    def test_invalid_ingredients(self):
+        self.authenticate(self.author_token)
+        url = '/api/recipes/{}/'.format(self.recipes[0].pk)
+        for ingredients in (
+            [{'id': self.ingredients[0].pk, 'amount': 1}] * 2,
+            [{'id': 0, 'amount': 1}],
+        ):
+            response = self.client.patch(
+                url, {'ingredients': ingredients}, format='json'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+            self.assertIn('ingredients', response.data)
+
+    def test_destroy(self):
+        self.authenticate(self.author_token)
+        self.assertMaxQueries(
+            14,
+            'delete',
+            '/api/recipes/{}/'.format(self.recipes[0].pk),
+            status=HTTPStatus.NO_CONTENT
+        )
+
+
+class RecipeSearchTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.borscht, self.soup = [
+            Recipe.objects.create(
+                name=name,
+                author=self.authors[0],
+                image='recipes/images/test.gif',
+                text=text,
+                cooking_time=30,
+            )
+            for name, text in (
+                ('Борщ', 'Наваристый суп со свёклой'),
+                ('Суп дня', 'Почти как борщ, только без свёклы'),
+            )
+        ]
+        update_search_documents()
+
+    def search(self, query, **params):
+        response = self.client.get(
+            '/api/recipes/', dict(params, search=query)
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_relevance(self):
+        self.assertEqual(
+            self.search('борщ'), [self.borscht.pk, self.soup.pk]
+        )
+        self.assertEqual(
+            self.search('суп'), [self.soup.pk, self.borscht.pk]
+        )
+
+    def test_ingredients(self):
+        self.assertEqual(
+            len(self.search('ингредиент 7', limit=50)), 5
+        )
+        self.assertEqual(self.search('ингредиент борщ'), [])
+
+    def test_keyset(self):
+        first = self.client.get(
+            '/api/recipes/', {'search': 'борщ', 'cursor': '', 'limit': 1}
+        ).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(
+            [first['results'][0]['id'], second['results'][0]['id']],
+            [self.borscht.pk, self.soup.pk]
+        )
+
+    def test_budget(self):
+        self.authenticate()
+        self.assertPageQueries(6, '/api/recipes/?search=рецепт')
+
+    def test_updated_on_save(self):
+        self.authenticate(self.author_token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                '/api/recipes/{}/'.format(self.soup.pk),
+                {'name': 'Солянка'},
+                format='json'
+            )
+        self.assertEqual(self.search('солянка'), [self.soup.pk])
+
+    def test_updated_on_ingredient_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[7].delete()
+        # Recipes 3 to 7 used it; "Рецепт 7" still matches by its name.
+        self.assertEqual(self.search('ингредиент 7'), [self.recipes[7].pk])
+
+
+class RecipeMatchTests(QueryBudgetTestCase):
+    URL = '/api/recipes/match/'
+
+    def match(self, ingredients, **params):
+        response = self.client.get(self.URL, dict(
+            params, ingredients=[ingredient.pk for ingredient in ingredients]
+        ))
+        self.assertEqual(response.status_code, HTTPStatus.OK, response.data)
+        return [
+            (recipe['id'], recipe['coverage'], recipe['missing'])
+            for recipe in response.json()['results']
+        ]
+
+    def test_coverage(self):
+        # Recipe n uses ingredients n to n + 4.
+        have = self.ingredients[:5]
+        self.assertEqual(self.match(have), [(self.recipes[0].pk, 1.0, 0)])
+        self.assertEqual(
+            self.match(have, missing=4),
+            [
+                (self.recipes[number].pk, (5 - number) / 5, number)
+                for number in range(5)
+            ]
+        )
+        self.assertEqual(self.match(self.ingredients[25:]), [])
+
+    def test_invalid(self):
+        for params in ({}, {'ingredients': 'x'}, {
+            'ingredients': self.ingredients[0].pk, 'missing': -1
+        }):
+            with self.subTest(params=params):
+                response = self.client.get(self.URL, params)
+                self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_budget(self):
+        self.authenticate()
+        url = '{}?ingredients={}&missing=4'.format(
+            self.URL, self.ingredients[2].pk
+        )
+        # The first request builds the index.
+        self.assertMaxQueries(6, 'get', url)
+        self.assertMaxQueries(5, 'get', url)
+
+    def test_updated_on_save(self):
+        self.match(self.ingredients[:5])
+        self.authenticate(self.author_token)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                '/api/recipes/{}/'.format(self.recipes[3].pk),
+                {
+                    'ingredients': [
+                        {'id': ingredient.pk, 'amount': 1}
+                        for ingredient in self.ingredients[:2]
+                    ],
+                },
+                format='json'
+            )
+        self.assertEqual(
+            self.match(self.ingredients[:5]),
+            [(self.recipes[0].pk, 1.0, 0), (self.recipes[3].pk, 1.0, 0)]
+        )
+
+    def test_updated_on_ingredient_delete(self):
+        self.match(self.ingredients[:5])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[4].delete()
+        # Recipe 0 is left with ingredients 0 to 3.
+        self.assertEqual(
+            self.match(self.ingredients[:4]), [(self.recipes[0].pk, 1.0, 0)]
+        )
+
+
+class FavoriteAndShoppingCartQueryBudgetTests(QueryBudgetTestCase):
+    def test_favorite(self):
+        self.authenticate()
+        url = '/api/recipes/{}/favorite/'.format(self.recipes[1].pk)
+        self.assertMaxQueries(12, 'post', url)
+        self.assertMaxQueries(5, 'delete', url, status=HTTPStatus.NO_CONTENT)
+
+    def test_shopping_cart(self):
+        self.authenticate()
+        url = '/api/recipes/{}/shopping_cart/'.format(self.recipes[1].pk)
+        self.assertMaxQueries(12, 'post', url)
+        self.assertMaxQueries(5, 'delete', url, status=HTTPStatus.NO_CONTENT)
+
+    def test_download_shopping_cart(self):
+        self.authenticate()
+        self.assertMaxQueries(2, 'get', '/api/recipes/download_shopping_cart/')
+
+
+class BulkRelationTests(QueryBudgetTestCase):
+    def test_bulk_favorite(self):
+        self.authenticate()
+        favorites = set(self.reader.favorites.values_list('pk', flat=True))
+        ids = [recipe.pk for recipe in self.recipes] + [0]
+        response = self.client.post(
+            '/api/recipes/favorite/', {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            set(response.data['added']), set(ids[:-1]) - favorites
+        )
+        self.assertEqual(set(response.data['existing']), favorites)
+        self.assertEqual(response.data['invalid'], [0])
+        self.assertEqual(
+            self.reader.favorites.count(), len(self.recipes)
+        )
+
+    def test_bulk_budget(self):
+        self.authenticate()
+        for size in (1, len(self.recipes)):
+            ids = [recipe.pk for recipe in self.recipes[:size]]
+            with self.subTest(size=size):
+                self.assertMaxQueries(
+                    8, 'post', '/api/recipes/shopping_cart/', {'ids': ids}
+                )
+                self.assertMaxQueries(
+                    7, 'delete', '/api/recipes/shopping_cart/', {'ids': ids}
+                )
+        self.assertFalse(self.reader.shopping_cart.exists())
+
+    def test_bulk_subscribe(self):
+        self.authenticate(self.author_token)
+        ids = [self.reader.pk, self.authors[0].pk, self.authors[1].pk]
+        response = self.client.post(
+            '/api/users/subscribe/', {'ids': ids}, format='json'
+        )
+        self.assertEqual(
+            response.data['added'],
+            sorted([self.reader.pk, self.authors[1].pk])
+        )
+        self.assertEqual(response.data['invalid'], [self.authors[0].pk])
+        response = self.client.delete(
+            '/api/users/subscribe/', {'ids': ids}, format='json'
+        )
+        self.assertEqual(
+            response.data['removed'],
+            sorted([self.reader.pk, self.authors[1].pk])
+        )
+
+    def test_bulk_invalid(self):
+        self.authenticate()
+        for data in ({}, {'ids': []}, {'ids': ['x']}):
+            response = self.client.post(
+                '/api/recipes/favorite/', data, format='json'
+            )
+            self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class ShoppingCartExportTests(QueryBudgetTestCase):
+    URL = '/api/recipes/download_shopping_cart/'
+
+    def test_cached_document(self):
+        self.authenticate()
+        first = self.client.get(self.URL)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertTrue(first.content.startswith(b'%PDF'))
+        self.assertEqual(self.client.get(self.URL).content, first.content)
+        self.reader.shopping_cart.remove(self.recipes[0])
+        self.assertNotEqual(self.client.get(self.URL).content, first.content)
+
+    def wait_for_job(self, response):
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        for _ in range(100):
+            job = self.client.get(response.data['url']).data
+            if job['status'] != 'pending':
+                return job
+            time.sleep(0.05)
+        self.fail('The export job is still pending.')
+
+    @override_settings(EXPORT_SYNC_MAX_ROWS=0)
+    def test_background_job(self):
+        self.authenticate()
+        job = self.wait_for_job(self.client.get(self.URL))
+        self.assertEqual(job['status'], 'done')
+        response = self.client.get(job['url'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    @override_settings(EXPORT_SYNC_MAX_ROWS=0)
+    def test_failed_job_is_retried(self):
+        self.authenticate()
+        with mock.patch.object(
+            exporters.PDFExporter, 'render', side_effect=RuntimeError
+        ), self.assertLogs('api.exporters', 'ERROR'):
+            job = self.wait_for_job(self.client.get(self.URL))
+        self.assertEqual(job['status'], 'failed')
+        job = self.wait_for_job(self.client.get(self.URL))
+        self.assertEqual(job['status'], 'done')
+        response = self.client.get(job['url'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    @override_settings(EXPORT_SYNC_MAX_ROWS=0)
+    def test_evicted_document_is_rendered_again(self):
+        self.authenticate()
+        response = self.client.get(self.URL)
+        job = self.wait_for_job(response)
+        self.assertEqual(job['status'], 'done')
+        digest = response.data['id'].split('-', 1)[1]
+        exporters.get_cache().delete(exporters._document_key(
+            exporters.get_exporter('pdf'), self.reader.id, digest
+        ))
+        job = self.wait_for_job(self.client.get(job['url']))
+        self.assertEqual(job['status'], 'done')
+        response = self.client.get(job['url'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_font_parsed_once(self):
+        exporter = exporters.get_exporter('pdf')
+        rows = [{
+            'name': 'соль', 'amount': 5, 'measurement_unit': 'г'
+        }]
+        add_font = exporters.FPDF.add_font
+        with mock.patch.object(exporters, '_pdf_template', None), \
+                mock.patch.object(
+                    exporters.FPDF, 'add_font', autospec=True,
+                    side_effect=add_font
+                ) as parse:
+            first = exporter.render(rows)
+            second = exporter.render(rows * 2)
+        self.assertEqual(parse.call_count, 1)
+        self.assertTrue(first.startswith(b'%PDF'))
+        self.assertNotEqual(first, second)
+
+    def export(self, export_format):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.URL, {'format': export_format})
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            content = b''.join(response.streaming_content).decode()
+        self.assertLessEqual(len(context), 2)
+        return content
+
+    def test_text(self):
+        self.authenticate()
+        lines = self.export('txt').splitlines()
+        self.assertEqual(len(lines), len(self.expected_ingredients()))
+        self.assertRegex(lines[0], r'^\S.* - \d+ \S+$')
+
+    def test_csv(self):
+        self.authenticate()
+        rows = list(csv.reader(io.StringIO(self.export('csv'))))
+        self.assertEqual(rows[0], ['name', 'amount', 'measurement_unit'])
+        self.assertEqual(
+            {row[0]: int(row[1]) for row in rows[1:]},
+            self.expected_ingredients()
+        )
+
+    def test_json(self):
+        self.authenticate()
+        data = json.loads(self.export('json'))
+        self.assertEqual(
+            {row['name']: row['amount'] for row in data},
+            self.expected_ingredients()
+        )
+
+    def test_empty_json(self):
+        self.authenticate(self.author_token)
+        self.assertEqual(json.loads(self.export('json')), [])
+
+    def test_unknown_format(self):
+        self.authenticate()
+        response = self.client.get(self.URL, {'format': 'xls'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def expected_ingredients(self):
+        totals = {}
+        for recipe in self.reader.shopping_cart.all():
+            for row in recipe.ingredients.select_related('ingredient'):
+                name = row.ingredient.name
+                totals[name] = totals.get(name, 0) + row.amount
+        return totals
+
+    def test_unknown_job(self):
+        self.authenticate()
+        response = self.client.get(self.URL + 'jobs/unknown/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class SubscriptionQueryBudgetTests(QueryBudgetTestCase):
+    def test_subscribe(self):
+        self.authenticate(self.author_token)
+        url = '/api/users/{}/subscribe/'.format(self.authors[1].pk)
+        self.assertMaxQueries(6, 'post', url)
+        self.assertMaxQueries(4, 'delete', url, status=HTTPStatus.NO_CONTENT)
+
+    def test_subscriptions(self):
+        self.authenticate()
+        self.assertPageQueries(4, '/api/users/subscriptions/')
+        for limit in (0, 1, 5):
+            with self.subTest(recipes_limit=limit):
+                self.assertPageQueries(
+                    4,
+                    '/api/users/subscriptions/?recipes_limit={}'.format(limit)
+                )
+
+    def test_subscriptions_keyset(self):
+        self.authenticate()
+        self.assertPageQueries(3, '/api/users/subscriptions/?cursor=')
+
+    def test_subscriptions_content(self):
+        self.authenticate()
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        author = response.json()['results'][-1]
+        self.assertEqual(author['id'], self.authors[0].pk)
+        self.assertTrue(author['is_subscribed'])
+        self.assertEqual(author['recipes_count'], 8)
+        self.assertEqual(
+            [recipe['id'] for recipe in author['recipes']],
+            [recipe.pk for recipe in self.recipes[::3]][::-1][:2]
+        )
+
+
+class CatalogQueryBudgetTests(QueryBudgetTestCase):
+    def test_tags(self):
+        self.assertMaxQueries(1, 'get', '/api/tags/')
+        self.assertMaxQueries(
+            1, 'get', '/api/tags/{}/'.format(self.tags[0].pk)
+        )
+
+    def test_ingredients(self):
+        self.assertMaxQueries(1, 'get', '/api/ingredients/')
+        self.assertMaxQueries(1, 'get', '/api/ingredients/?name=ингр')
+        self.assertMaxQueries(
+            1, 'get', '/api/ingredients/{}/'.format(self.ingredients[0].pk)
+        )
+
+
+class CatalogCacheTests(QueryBudgetTestCase):
+    def test_cached_response(self):
+        self.assertMaxQueries(1, 'get', '/api/ingredients/')
+        self.assertMaxQueries(0, 'get', '/api/ingredients/')
+
+    def test_not_modified(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(len(response.json()), len(self.tags))
+        response = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_invalidation(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+    def test_shared_cache_check(self):
+        self.assertEqual(checks.check_shared_cache(), [])
+        with self.settings(WEB_WORKERS=2):
+            self.assertEqual(
+                [error.id for error in checks.check_shared_cache()],
+                ['foodgram.E001']
+            )
+            with self.assertRaises(ImproperlyConfigured):
+                checks.require_shared_cache()
+            with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.'
+                           'PyMemcacheCache',
+                'LOCATION': 'cache:11211',
+            }}):
+                self.assertEqual(checks.check_shared_cache(), [])
+
+
+class RecipeHttpCacheTests(QueryBudgetTestCase):
+    def url(self, recipe):
+        return '/api/recipes/{}/'.format(recipe.pk)
+
+    def test_anonymous_cache(self):
+        for url in (
+            '/api/recipes/?tags=tag0&limit=3', self.url(self.recipes[0])
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('Authorization', response['Vary'])
+                self.assertMaxQueries(0, 'get', url)
+        # Parameter order does not split the cache.
+        self.assertMaxQueries(0, 'get', '/api/recipes/?limit=3&tags=tag0')
+
+    def test_anonymous_invalidation(self):
+        url = self.url(self.recipes[0])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[0].name = 'Щи'
+            self.recipes[0].save()
+        self.assertEqual(self.client.get(url).json()['name'], 'Щи')
+
+    def test_authenticated_not_cached(self):
+        self.authenticate()
+        url = self.url(self.recipes[1])
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.json()['is_favorited'])
+        self.client.post(url + 'favorite/')
+        self.assertTrue(self.client.get(url).json()['is_favorited'])
+
+    def test_etag(self):
+        self.authenticate()
+        # By the author behind author_token, not favorited by the reader.
+        url = self.url(self.recipes[3])
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(len(context), 2)
+        # The user's own flags are part of the version.
+        self.client.post(url + 'favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        self.authenticate(self.author_token)
+        response = self.client.patch(url, {'name': 'Щи'}, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.authenticate()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_etag_missing_recipe(self):
+        self.authenticate()
+        self.assertMaxQueries(
+            2, 'get', '/api/recipes/0/', status=HTTPStatus.NOT_FOUND
+        )
+
+
+class RecipeImageTests(QueryBudgetTestCase):
+    def create_recipe(self, image=IMAGE, status=HTTPStatus.CREATED):
+        self.authenticate()
+        response = self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+            'tags': [self.tags[0].pk],
+            'image': image,
+            'name': 'С картинкой',
+            'text': 'Описание',
+            'cooking_time': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, status, response.data)
+        return response.json()
+
+    def test_content_hashed_name(self):
+        name = '{}.gif'.format(hashlib.sha256(IMAGE_BYTES).hexdigest()[:32])
+        first = self.create_recipe()
+        self.assertTrue(first['image'].endswith('/recipes/images/' + name))
+        # The same picture is stored once.
+        self.assertEqual(self.create_recipe()['image'], first['image'])
+
+    def test_limits(self):
+        with self.settings(IMAGE_MAX_BYTES=len(IMAGE_BYTES) - 1):
+            self.assertIn(
+                'image',
+                self.create_recipe(status=HTTPStatus.BAD_REQUEST)
+            )
+        with self.settings(IMAGE_MAX_PIXELS=0):
+            self.assertIn(
+                'image',
+                self.create_recipe(status=HTTPStatus.BAD_REQUEST)
+            )
+        for image in (
+            'data:image/gif;base64,!!!!',
+            'data:image/gif;base64,' + base64.b64encode(b'text').decode(),
+            'data:image/gif,R0lGOD',
+        ):
+            with self.subTest(image=image):
+                self.assertIn('image', self.create_recipe(
+                    image, status=HTTPStatus.BAD_REQUEST
+                ))
+
+    def test_wrapped_base64(self):
+        text = IMAGE.partition(',')[2]
+        wrapped = 'data:image/gif;base64,' + '\n'.join(
+            text[position:position + 6]
+            for position in range(0, len(text), 6)
+        )
+        name = '{}.gif'.format(hashlib.sha256(IMAGE_BYTES).hexdigest()[:32])
+        # Chunk boundaries fall inside the quads and the line breaks.
+        with mock.patch.object(images, 'CHUNK_SIZE', 10):
+            recipe = self.create_recipe(wrapped)
+        self.assertTrue(recipe['image'].endswith('/recipes/images/' + name))
+
+    def test_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe()
+        self.assertEqual(recipe['image_variants'], {})
+        variants = self.client.get(
+            '/api/recipes/{}/'.format(recipe['id'])
+        ).json()['image_variants']
+        self.assertEqual(set(variants), {'thumbnail', 'medium'})
+        for urls in variants.values():
+            self.assertEqual(set(urls), {'webp', 'jpeg'})
+            for url in urls.values():
+                path = url.partition('/media/django/')[2]
+                self.assertTrue(
+                    os.path.exists(os.path.join(MEDIA_ROOT, path)), path
+                )
+
+    def test_worker_releases_connection(self):
+        calls = mock.Mock()
+        with mock.patch.object(
+            images, 'close_old_connections', calls.close_old_connections
+        ), mock.patch.object(
+            images, 'create_variants', calls.create_variants
+        ), mock.patch.object(
+            images, 'connection', calls.connection
+        ), self.assertLogs('api.images', 'ERROR'):
+            calls.create_variants.side_effect = RuntimeError
+            images._run_variants_in_worker(self.recipes[0].pk)
+        self.assertEqual(calls.mock_calls, [
+            mock.call.close_old_connections(),
+            mock.call.create_variants(self.recipes[0].pk),
+            mock.call.connection.close(),
+        ])
+
+    @override_settings(IMAGE_WORKERS=1)
+    def test_scheduled_in_worker(self):
+        with mock.patch.object(images, 'get_executor') as get_executor:
+            images.schedule_variants(self.recipes[0].pk)
+        get_executor().submit.assert_called_once_with(
+            images._run_variants_in_worker, self.recipes[0].pk
+        )
+
+
+class IngredientAutocompleteTests(QueryBudgetTestCase):
+    URL = '/api/ingredients/autocomplete/'
+
+    def setUp(self):
+        super().setUp()
+        for name in ('морская соль', 'солод', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def test_ranking(self):
+        response = self.client.get(self.URL, {'name': 'Сол'})
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.json()],
+            ['солод', 'соль', 'морская соль']
+        )
+
+    def test_limit(self):
+        response = self.client.get(self.URL, {'name': 'ингр', 'limit': 4})
+        self.assertEqual(len(response.json()), 4)
+
+    def test_served_from_memory(self):
+        self.assertMaxQueries(1, 'get', self.URL + '?name=соль')
+        self.assertMaxQueries(0, 'get', self.URL + '?name=мор')
+
+    def test_refresh(self):
+        self.client.get(self.URL, {'name': 'соль'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(
+                name='соль крупная', measurement_unit='г'
+            )
+        response = self.client.get(self.URL, {'name': 'соль '})
+        self.assertEqual(response.json()[0]['name'], 'соль крупная')
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class RequestMetricsTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+
+    def test_server_timing(self):
+        response = self.client.get('/api/recipes/')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, '
+            r'total;dur=[\d.]+$'
+        )
+        with self.settings(METRICS_SAMPLE_RATE=0):
+            response = self.client.get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_histograms(self):
+        self.client.get('/api/recipes/')
+        self.client.get('/api/recipes/')
+        self.authenticate()
+        self.client.get('/api/recipes/download_shopping_cart/?format=txt')
+        text = self.client.get('/metrics').content.decode()
+        for line in (
+            'foodgram_request_duration_seconds_count'
+            '{view="RecipeViewset.list"} 2',
+            'foodgram_request_duration_seconds_count'
+            '{view="GetShoppingCart"} 1',
+            'foodgram_sql_queries_bucket'
+            '{view="RecipeViewset.list",le="+Inf"} 2',
+            'foodgram_n_plus_one_total{view="RecipeViewset.list"} 0',
+        ):
+            self.assertIn(line, text)
+        self.assertRegex(
+            text,
+            r'foodgram_serializer_duration_seconds_sum'
+            r'\{view="RecipeViewset.list"\} 0\.\d*[1-9]'
+        )
+
+    def test_metrics_allowed_ips(self):
+        self.assertEqual(
+            self.client.get('/metrics').status_code, HTTPStatus.OK
+        )
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.assertEqual(
+                self.client.get('/metrics').status_code,
+                HTTPStatus.FORBIDDEN
+            )
+            response = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_duplicate_shapes(self):
+        self.assertEqual(
+            metrics.normalize_sql(
+                "SELECT * FROM t WHERE a = 'x' AND b IN (%s, %s, %s) "
+                'AND c = 10 AND U0.d = %s'
+            ),
+            'SELECT * FROM t WHERE a = ? AND b IN (?) AND c = ? AND U0.d = ?'
+        )
+        sample = metrics.RequestSample()
+        sample.queries = [
+            ('SELECT * FROM t WHERE id = %s', 0.001),
+            ('SELECT * FROM t WHERE id = %s', 0.001),
+            ('SELECT * FROM t WHERE id = %s', 0.001),
+            ('SELECT * FROM u', 0.001),
+        ]
+        self.assertEqual(
+            sample.duplicate_shapes(3), {'SELECT * FROM t WHERE id = ?': 3}
+        )
+
+
+class QueryDetectorTests(QueryBudgetTestCase):
+    def unjoined_rows(self):
+        return list(IngredientRecipe.objects.filter(recipe=self.recipes[0]))
+
+    def test_strict_mode_raises_in_the_field(self):
+        rows = self.unjoined_rows()
+        with self.assertRaises(detectors.QueryProblem) as raised:
+            with detectors.watch_queries('test', strict=True):
+                IngredientRecipeSerializer(rows, many=True).data
+        message = str(raised.exception)
+        self.assertIn('IngredientRecipeSerializer.get_id', message)
+        self.assertIn('api/serializers.py', message)
+
+    def test_structured_warning(self):
+        rows = self.unjoined_rows()
+        with self.assertLogs('api.detectors', 'WARNING') as logs:
+            with detectors.watch_queries('test', strict=False):
+                IngredientRecipeSerializer(rows, many=True).data
+        [record] = logs.records
+        self.assertEqual(record.query_problem['problem'], 'n_plus_one')
+        self.assertEqual(record.query_problem['view'], 'test')
+        self.assertEqual(
+            record.query_problem['owner'], 'IngredientRecipeSerializer.get_id'
+        )
+        self.assertEqual(record.query_problem['count'], len(rows))
+        self.assertIn('"recipes_ingredient"', record.query_problem['shape'])
+
+    def test_joined_rows_pass(self):
+        rows = list(
+            IngredientRecipe.objects
+            .filter(recipe=self.recipes[0])
+            .select_related('ingredient')
+        )
+        with detectors.watch_queries('test', strict=True):
+            IngredientRecipeSerializer(rows, many=True).data
+
+    @override_settings(QUERY_SLOW_MS=0)
+    def test_slow_query_never_raises(self):
+        with self.assertLogs('api.detectors', 'WARNING') as logs:
+            with detectors.watch_queries(
+                'test', ['api.detectors.SlowQueryDetector'], strict=True
+            ):
+                Tag.objects.count()
+        [record] = logs.records
+        self.assertEqual(record.query_problem['problem'], 'slow_query')
+        self.assertIn('api/tests.py', record.query_problem['location'])
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+    def test_list(self):
+        self.assertPageQueries(2, '/api/users/')
+        self.authenticate()
+        self.assertPageQueries(3, '/api/users/')
+
+    def test_retrieve(self):
+        self.authenticate()
+        self.assertMaxQueries(
+            2, 'get', '/api/users/{}/'.format(self.authors[0].pk)
+        )
+        self.assertMaxQueries(2, 'get', '/api/users/me/')
+
+    def test_create(self):
+        data = {
+            'email': 'new@foodgram.test',
+            'username': 'new',
+            'first_name': 'New',
+            'last_name': 'User',
+            'password': self.PASSWORD,
+        }
+        self.assertMaxQueries(
+            3, 'post', '/api/users/', data, status=HTTPStatus.CREATED
+        )
+
+    def test_set_password(self):
+        self.authenticate()
+        data = {
+            'current_password': self.PASSWORD,
+            'new_password': 'Another-pass-42',
+        }
+        self.assertMaxQueries(
+            2,
+            'post',
+            '/api/users/set_password/',
+            data,
+            status=HTTPStatus.NO_CONTENT
+        )
+
+    def test_token(self):
+        data = {'email': self.reader.email, 'password': self.PASSWORD}
+        self.assertMaxQueries(3, 'post', '/api/auth/token/login/', data)
+        self.authenticate()
+        self.assertMaxQueries(
+            2,
+            'post',
+            '/api/auth/token/logout/',
+            status=HTTPStatus.NO_CONTENT
+        )
@@ -5,10 +5,14 @@ from .views import (
     APIFavorite,
     APISubscribe,
     APIToShoppingCart,
+    BulkFavorite,
+    BulkShoppingCart,
+    BulkSubscribe,
     CustomUserViewSet,
     GetShoppingCart,
     IngredientViewSet,
     RecipeViewset,
+    ShoppingCartJob,
     SubscriptionList,
     TagViewSet
 )
@@ -21,7 +25,19 @@ router.register(r'ingredients', IngredientViewSet, basename='ingredient')
 router.register(r'users', CustomUserViewSet, basename='user')
 
 urlpatterns = [
-    path('recipes/download_shopping_cart/', GetShoppingCart.as_view()),
+    path(
+        'recipes/download_shopping_cart/',
+        GetShoppingCart.as_view(),
+        name='shopping-cart'
+    ),
+    path(
+        'recipes/download_shopping_cart/jobs/<str:job_id>/',
+        ShoppingCartJob.as_view(),
+        name='shopping-cart-job'
+    ),
+    path('recipes/favorite/', BulkFavorite.as_view()),
+    path('recipes/shopping_cart/', BulkShoppingCart.as_view()),
+    path('users/subscribe/', BulkSubscribe.as_view()),
     path('recipes/<int:pk>/favorite/', APIFavorite.as_view()),
     path('recipes/<int:pk>/shopping_cart/', APIToShoppingCart.as_view()),
     path('users/<int:pk>/subscribe/', APISubscribe.as_view()),
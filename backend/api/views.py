@@ -1,28 +1,55 @@
-import io
+import hashlib
 
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import FileResponse
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse as django_reverse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers
+)
+from django.utils.http import quote_etag
 from djoser.views import UserViewSet
-from fpdf import FPDF
 from rest_framework import filters, generics, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
 from users.models import User
 from api.filters import RecipeFilter
+from . import exporters
+from .autocomplete import ingredient_index
+from .caching import CachedCatalogMixin, get_generation
+from .matching import recipe_index
+from .pagination import (
+    PageNumberAndLimitPagination,
+    PageNumberOrKeysetPagination
+)
 from .permissions import IsOwnerOrAdminOrReadOnly
+from .services import (
+    add_related,
+    get_shopping_cart_ingredients,
+    remove_related
+)
 from .serializers import (
     AnonymousRecipeSerializer,
     AnonymousUserSerializer,
+    BulkIdsSerializer,
     CustomUserSerializer,
     IngredientSerializer,
     ListRetrieveRecipeSerializer,
     RecipeCreateUpdateSerializer,
+    RecipeMatchSerializer,
     SubscriptionsSerializer,
-    TagSerializer
+    TagSerializer,
+    get_recipes_limit
 )
 
 
@@ -32,11 +59,17 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = CustomUserSerializer
 
     def get_serializer_class(self):
+        if self.action == 'set_password':
+            return super().get_serializer_class()
         user = self.request.user
         if user.is_anonymous:
             return AnonymousUserSerializer
         return self.serializer_class
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        return queryset.with_is_subscribed(self.request.user)
+
 
 class APISubscribe(APIView):
     def post(self, request, *args, **kwargs):
@@ -95,70 +128,170 @@ class APIToShoppingCart(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class BulkRelationView(APIView):
+    """
+    Add (POST) or remove (DELETE) many objects of one of the current
+    user's many-to-many relations. The body is ``{"ids": [...]}``.
+    """
+    relation = None
+
+    def get_ids(self):
+        serializer = BulkIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['ids']
+
+    def get_manager(self):
+        return getattr(self.request.user, self.relation)
+
+    def get_excluded_ids(self):
+        return ()
+
+    def post(self, request):
+        added, existing, invalid = add_related(
+            self.get_manager(), self.get_ids(), self.get_excluded_ids()
+        )
+        return Response({
+            'added': sorted(added),
+            'existing': sorted(existing),
+            'invalid': sorted(invalid),
+        })
+
+    def delete(self, request):
+        removed = remove_related(self.get_manager(), self.get_ids())
+        return Response({'removed': sorted(removed)})
+
+
+class BulkFavorite(BulkRelationView):
+    relation = 'favorites'
+
+
+class BulkShoppingCart(BulkRelationView):
+    relation = 'shopping_cart'
+
+
+class BulkSubscribe(BulkRelationView):
+    relation = 'following'
+
+    def get_excluded_ids(self):
+        return (self.request.user.pk,)
+
+
 class GetShoppingCart(APIView):
+    def perform_content_negotiation(self, request, force=False):
+        # ``format`` picks the export format here, not a renderer.
+        return super().perform_content_negotiation(request, force=True)
+
     def get(self, request):
-        user = request.user
-        recipes = user.shopping_cart.all()
-        ingredients = {}
-        for recipe in recipes:
-            ingredient_recipe_queryset = recipe.ingredients.all()
-            for ingredient_recipe in ingredient_recipe_queryset:
-                ingredient = ingredient_recipe.ingredient
-                id = ingredient.id
-                name = ingredient.name
-                unit = ingredient.measurement_unit
-                amount = ingredient_recipe.amount
-
-                if id in ingredients:
-                    ingredients[id][1] += amount
-                else:
-                    ingredients[id] = [name, amount, unit]
-
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.add_font(
-            family='Attractive',
-            style='',
-            fname=r'/app/font/Attractive-Regular.ttf'
+        name = request.query_params.get('format', exporters.DEFAULT_FORMAT)
+        exporter = exporters.get_exporter(name)
+        if exporter is None:
+            return Response(
+                {
+                    'format': 'Неизвестный формат. Доступны: {}'.format(
+                        ', '.join(exporters.EXPORTERS)
+                    )
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ingredients = get_shopping_cart_ingredients(request.user)
+        if exporter.streaming:
+            response = StreamingHttpResponse(
+                exporter.stream(ingredients.iterator()),
+                content_type=exporter.content_type
+            )
+        else:
+            ingredients = list(ingredients)
+            digest = exporters.cart_digest(ingredients)
+            content = exporters.get_cached_document(
+                exporter, request.user.id, digest
+            )
+            if content is None:
+                if len(ingredients) > settings.EXPORT_SYNC_MAX_ROWS:
+                    job_id = exporters.start_job(
+                        exporter, request.user.id, digest, ingredients
+                    )
+                    return Response(
+                        {
+                            'id': job_id,
+                            'status': exporters.PENDING,
+                            # Not DRF's reverse(), which would carry
+                            # ?format= over to the job URL.
+                            'url': request.build_absolute_uri(
+                                django_reverse(
+                                    'shopping-cart-job', args=(job_id,)
+                                )
+                            ),
+                        },
+                        status=status.HTTP_202_ACCEPTED
+                    )
+                content = exporters.render_cached_document(
+                    exporter, request.user.id, digest, ingredients
+                )
+            response = HttpResponse(
+                content, content_type=exporter.content_type
+            )
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            exporter.filename
         )
-        pdf.set_font('Attractive', "", 16)
-        for ingredient in ingredients.values():
-            ingredient_line = (
-                ingredient[0].capitalize()
-                + ' - '
-                + str(ingredient[1])
-                + ' '
-                + ingredient[2]
+        return response
+
+
+class ShoppingCartJob(APIView):
+    def get(self, request, job_id):
+        job = exporters.get_job(request.user.id, job_id)
+        if job is None:
+            return Response(
+                {'errors': 'Задача не найдена'},
+                status=status.HTTP_404_NOT_FOUND
             )
-            pdf.cell(
-                40,
-                10,
-                ingredient_line,
-                new_x="LMARGIN",
-                new_y="NEXT",
-                align='L'
+        data = {'id': job_id, 'status': job['status']}
+        if job['status'] == exporters.DONE:
+            data['url'] = '{}?format={}'.format(
+                reverse('shopping-cart', request=request), job['format']
             )
-        buffer = io.BytesIO(bytes(pdf.output()))
-        return FileResponse(buffer, as_attachment=True, filename='hello.pdf')
+        return Response(data)
 
 
 class SubscriptionList(generics.ListAPIView):
     serializer_class = SubscriptionsSerializer
+    pagination_class = PageNumberOrKeysetPagination
 
     def get_queryset(self):
         user = self.request.user
-        queryset = user.following.all()
-        return queryset
+        # Each author's latest recipes, limited per author in SQL so the
+        # prefetch stays one query whatever recipes_limit is.
+        latest_recipes = Recipe.objects.filter(
+            pk__in=Subquery(
+                Recipe.objects
+                .filter(author=OuterRef('author'))
+                .order_by('-id')
+                .values('pk')[:get_recipes_limit(self.request)]
+            )
+        )
+        return (
+            user.following
+            .with_is_subscribed(user)
+            .prefetch_related(
+                Prefetch(
+                    'recipes',
+                    queryset=latest_recipes,
+                    to_attr='recipes_preview'
+                )
+            )
+            .order_by('-id')
+        )
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedCatalogMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_name = 'tags'
     permission_classes = (AllowAny,)
     pagination_class = None
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedCatalogMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_name = 'ingredients'
     permission_classes = (AllowAny,)
     pagination_class = None
     queryset = Ingredient.objects.all()
@@ -166,17 +299,132 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (filters.SearchFilter,)
     search_fields = ('^name',)
 
+    @action(detail=False)
+    def autocomplete(self, request):
+        """
+        Ingredients whose name starts with, then contains, the query.
+        Served from an in-memory index instead of the database.
+        """
+        query = request.query_params.get(api_settings.SEARCH_PARAM, '')
+        try:
+            limit = int(request.query_params.get('limit'))
+        except (TypeError, ValueError):
+            limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        limit = min(limit, settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT)
+        ingredient_index.refresh()
+        return Response([
+            {'id': id, 'name': name, 'measurement_unit': measurement_unit}
+            for id, name, measurement_unit in ingredient_index.search(
+                query, limit
+            )
+        ])
+
 
-class RecipeViewset(viewsets.ModelViewSet):
+class RecipeViewset(CachedCatalogMixin, viewsets.ModelViewSet):
+    catalog_name = 'recipes'
+    catalog_timeout = settings.RECIPE_CACHE_TIMEOUT
+    catalog_max_age = settings.RECIPE_CACHE_MAX_AGE
     queryset = Recipe.objects.all()
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
     serializer_class = RecipeCreateUpdateSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    pagination_class = PageNumberOrKeysetPagination
+
+    def is_cacheable(self):
+        """Only anonymous reads are the same for everyone."""
+        return self.request.user.is_anonymous
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Authenticated reads are revalidated with an ETag of the recipe
+        version, so unchanged recipes are not serialized again.
+        """
+        if self.is_cacheable():
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.get_version_etag()
+        if etag is None:
+            raise Http404
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_version_etag(self):
+        """
+        ETag of the recipe as the current user sees it, from one query:
+        its version, the user's flags and the embedded author, plus the
+        tag and ingredient catalog generations. None if there is no such
+        recipe.
+        """
+        user = self.request.user
+        try:
+            version = (
+                Recipe.objects
+                .with_user_flags(user)
+                .annotate(is_subscribed=Exists(
+                    User.following.through.objects.filter(
+                        from_user=user, to_user=OuterRef('author')
+                    )
+                ))
+                .filter(pk=self.kwargs[self.lookup_field])
+                .values_list(
+                    'modified',
+                    'is_favorited',
+                    'is_in_shopping_cart',
+                    'is_subscribed',
+                    'author__email',
+                    'author__username',
+                    'author__first_name',
+                    'author__last_name',
+                )
+                .first()
+            )
+        except ValueError:
+            return None
+        if version is None:
+            return None
+        return quote_etag(hashlib.md5(repr((
+            version,
+            get_generation('tags'),
+            get_generation('ingredients'),
+        )).encode()).hexdigest())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        # Anonymous responses are public, so shared caches must tell them
+        # apart from authenticated ones.
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_queryset(self):
+        user = self.request.user
+        return (
+            Recipe.objects
+            .with_user_flags(user)
+            .prefetch_related(
+                'tags',
+                Prefetch(
+                    'ingredients',
+                    queryset=IngredientRecipe.objects.select_related(
+                        'ingredient'
+                    )
+                ),
+                Prefetch(
+                    'author',
+                    queryset=User.objects.with_is_subscribed(user)
+                ),
+            )
+        )
 
     def get_serializer_class(self):
         user = self.request.user
-        if (self.action == 'list') or (self.action == 'retrieve'):
+        if self.action in ('list', 'retrieve', 'match'):
             if user.is_anonymous:
                 return AnonymousRecipeSerializer
             return ListRetrieveRecipeSerializer
@@ -184,3 +432,32 @@ class RecipeViewset(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+
+    @action(detail=False)
+    def match(self, request):
+        """
+        Recipes that can be cooked from the given ingredients, missing at
+        most ``missing`` others, best coverage first. Matched against an
+        in-memory inverted index; only the page is read from the database.
+        """
+        params = RecipeMatchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        recipe_index.refresh()
+        matches = recipe_index.match(
+            params.validated_data['ingredients'],
+            params.validated_data['missing']
+        )
+        paginator = PageNumberAndLimitPagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        results = []
+        for recipe_id, matched, missing in page:
+            if recipe_id in recipes:
+                results.append(dict(
+                    self.get_serializer(recipes[recipe_id]).data,
+                    coverage=round(matched / (matched + missing), 3),
+                    missing=missing,
+                ))
+        return paginator.get_paginated_response(results)
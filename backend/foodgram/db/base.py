@@ -0,0 +1,207 @@
+"""
+PostgreSQL backend with connection health checks, a statement timeout for
+requests and an optional in-process connection pool.
+
+It reads these extra keys of a DATABASES entry:
+
+* ``CONN_HEALTH_CHECKS``: ping a reused connection before its first query
+  in a request and reconnect if the server dropped it, as Django 4.1 does.
+* ``STATEMENT_TIMEOUT``: milliseconds, in effect while a thread serves a
+  request only, so management commands and worker threads are not limited.
+* ``POOL_SIZE``: when positive, the threads of a process share up to that
+  many connections, which go back to the pool at the end of each request
+  instead of being closed. ``POOL_TIMEOUT`` is how many seconds a thread
+  waits for a free one.
+"""
+import os
+import threading
+import weakref
+from functools import partial
+
+from django.core.signals import request_finished, request_started
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+Database = base.Database
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools inherited over fork are kept referenced: finalizing them would
+# close the sockets the parent still uses.
+_inherited = []
+_local = threading.local()
+# Statement timeout set on each open connection. A connection outlives the
+# request that opened it, and a pooled one moves between threads.
+_timeouts = weakref.WeakKeyDictionary()
+
+
+def _start_serving(**kwargs):
+    _local.serving = True
+
+
+def _stop_serving(**kwargs):
+    _local.serving = False
+
+
+request_started.connect(_start_serving)
+request_finished.connect(_stop_serving)
+
+
+class ConnectionPool:
+    """Up to ``size`` connections, handed out one per thread at a time."""
+
+    def __init__(self, size, timeout, health_checks):
+        self.pid = os.getpid()
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def get(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                'No free database connection in the pool after {} s.'.format(
+                    self.timeout
+                )
+            )
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return connect()
+                if self.usable(connection):
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def usable(self, connection):
+        if connection.closed:
+            return False
+        if not self.health_checks:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Database.Error:
+            return False
+        return True
+
+    def put(self, connection):
+        """Take a connection back, rolled back to a clean state."""
+        try:
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                connection.close()
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # rollback() does nothing in autocommit mode.
+                with connection.cursor() as cursor:
+                    cursor.execute('ROLLBACK')
+        except Database.Error:
+            connection.close()
+        if not connection.closed:
+            with self.lock:
+                self.idle.append(connection)
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool(alias, settings_dict):
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(
+                settings_dict['POOL_SIZE'],
+                settings_dict.get('POOL_TIMEOUT', 5),
+                settings_dict.get('CONN_HEALTH_CHECKS', False),
+            )
+        return pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pooled(self):
+        return bool(self.settings_dict.get('POOL_SIZE'))
+
+    @property
+    def statement_timeout(self):
+        """STATEMENT_TIMEOUT while this thread serves a request, else 0."""
+        if not getattr(_local, 'serving', False):
+            return 0
+        return self.settings_dict.get('STATEMENT_TIMEOUT') or 0
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        timeout = self.statement_timeout
+        if timeout:
+            params['options'] = ' '.join(filter(None, (
+                params.get('options'),
+                '-c statement_timeout={:d}'.format(timeout),
+            )))
+        return params
+
+    def open_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        _timeouts[connection] = self.statement_timeout
+        return connection
+
+    def get_new_connection(self, conn_params):
+        if not self.pooled:
+            return self.open_connection(conn_params)
+        connection = get_pool(self.alias, self.settings_dict).get(
+            partial(self.open_connection, conn_params)
+        )
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if not self.pooled:
+            return super()._close()
+        with self.wrap_database_errors:
+            get_pool(self.alias, self.settings_dict).put(self.connection)
+
+    def connect(self):
+        # A new connection needs no health check.
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        # Runs when a request starts and ends.
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not self.in_atomic_block
+        ):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+        super().ensure_connection()
+        # Outside a transaction, whose rollback would undo the SET.
+        timeout = self.statement_timeout
+        if self.autocommit and _timeouts.get(self.connection, 0) != timeout:
+            with self.wrap_database_errors:
+                with self.connection.cursor() as cursor:
+                    cursor.execute('SET statement_timeout = %s', [timeout])
+            _timeouts[self.connection] = timeout
@@ -0,0 +1,84 @@
+import logging
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+
+def connection_budget(alias=DEFAULT_DB_ALIAS):
+    """
+    Connections gunicorn may hold at once and how many the PostgreSQL
+    server accepts, or None for other databases.
+
+    Each of the WEB_WORKERS processes holds a connection per request
+    thread and image worker thread, or its pool when pooling is on.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return None
+    if connection.settings_dict.get('POOL_SIZE'):
+        per_worker = connection.settings_dict['POOL_SIZE']
+    else:
+        per_worker = settings.WEB_THREADS + settings.IMAGE_WORKERS
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT current_setting('max_connections')::int"
+            " - current_setting('superuser_reserved_connections')::int"
+        )
+        available = cursor.fetchone()[0]
+    return settings.WEB_WORKERS * per_worker, available
+
+
+@register(Tags.database)
+def check_connection_budget(app_configs=None, databases=None, **kwargs):
+    warnings = []
+    for alias in databases or ():
+        budget = connection_budget(alias)
+        if budget is not None and budget[0] > budget[1]:
+            warnings.append(Warning(
+                '{} gunicorn connections may be open at once, the '
+                '"{}" database accepts {}.'.format(
+                    budget[0], alias, budget[1]
+                ),
+                hint='Lower WEB_WORKERS, WEB_THREADS or DB_POOL_SIZE, or '
+                     'raise max_connections.',
+                id='foodgram.W001',
+            ))
+    return warnings
+
+
+@register()
+def check_engine(app_configs=None, **kwargs):
+    """The stock PostgreSQL backend ignores the keys foodgram.db adds."""
+    warnings = []
+    for alias, settings_dict in settings.DATABASES.items():
+        if settings_dict['ENGINE'] in (
+            'django.db.backends.postgresql',
+            'django.db.backends.postgresql_psycopg2',
+        ) and (
+            settings_dict.get('POOL_SIZE')
+            or settings_dict.get('STATEMENT_TIMEOUT')
+        ):
+            warnings.append(Warning(
+                'The "{}" database uses {}, which ignores POOL_SIZE, '
+                'STATEMENT_TIMEOUT and CONN_HEALTH_CHECKS.'.format(
+                    alias, settings_dict['ENGINE']
+                ),
+                hint='Set DB_ENGINE=foodgram.db, the same backend with '
+                     'these options.',
+                id='foodgram.W002',
+            ))
+    return warnings
+
+
+def warn_connection_budget():
+    """Log the check when gunicorn starts, and drop its connection."""
+    try:
+        for warning in check_connection_budget(databases=[DEFAULT_DB_ALIAS]):
+            logger.warning('%s %s', warning.msg, warning.hint)
+    except DatabaseError:
+        logger.warning('Could not check the database connection budget.')
+    finally:
+        connections[DEFAULT_DB_ALIAS].close()
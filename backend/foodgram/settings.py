@@ -1,4 +1,5 @@
 import os
+from datetime import datetime, timedelta, timezone
 
 from pathlib import Path
 
@@ -38,6 +39,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.detectors.QueryDetectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,17 +75,120 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
 
+# Worker processes and threads per worker of the app server, also used to
+# check the number of database connections against max_connections.
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', default=1))
+WEB_THREADS = int(os.getenv('WEB_THREADS', default=1))
+
+# foodgram.db keeps connections for DB_CONN_MAX_AGE seconds and pings them
+# once per request before reuse. With DB_POOL_SIZE the threads of a worker
+# share that many connections instead, returned after each request. Queries
+# of requests are cancelled after DB_STATEMENT_TIMEOUT ms (0 disables).
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', default=0))
+# The stock PostgreSQL backend ignores these options, see foodgram.W002.
+DB_ENGINE = os.getenv('DB_ENGINE', default='foodgram.db')
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql'),
+        'ENGINE': DB_ENGINE,
         'NAME': os.getenv('DB_NAME', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db2'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else int(
+            os.getenv('DB_CONN_MAX_AGE', default=60)
+        ),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL_SIZE': DB_POOL_SIZE,
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=5)),
+        'STATEMENT_TIMEOUT': int(
+            os.getenv('DB_STATEMENT_TIMEOUT', default=10000)
+        ),
+    }
+}
+
+# Generation tokens in this cache invalidate everything cached below, so
+# with several app server processes it must be shared: docker-compose runs
+# memcached (PyMemcacheCache at cache:11211). The process-local default
+# suits runserver and tests; check foodgram.E001 rejects it when
+# WEB_WORKERS > 1.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
     }
 }
 
+# Cache for pre-rendered tag and ingredient responses.
+CATALOG_CACHE_ALIAS = os.getenv('CATALOG_CACHE_ALIAS', default='default')
+
+# Rendered shopping list documents, keyed by user and cart contents. Carts
+# with more than EXPORT_SYNC_MAX_ROWS ingredients are rendered by a pool of
+# EXPORT_WORKERS threads and fetched once their job is done; job state lives
+# in this cache too, so it must be shared between workers as well.
+EXPORT_CACHE_ALIAS = os.getenv('EXPORT_CACHE_ALIAS', default='default')
+EXPORT_CACHE_TIMEOUT = 60 * 60
+EXPORT_SYNC_MAX_ROWS = int(os.getenv('EXPORT_SYNC_MAX_ROWS', default=200))
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', default=2))
+
+# Most ids accepted by one bulk favorite/shopping cart/subscribe request.
+BULK_MAX_IDS = 1000
+
+# Recipe feed ranks (?ordering=popular|trending), see RecipeScore. A new
+# half-life applies to additions folded from then on; the epoch only keeps
+# the stored logarithms small and must not change once scores exist.
+RECIPE_SCORE_WEIGHTS = {'favorite': 2.0, 'shopping_cart': 1.0}
+RECIPE_SCORE_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+RECIPE_TRENDING_HALF_LIFE = timedelta(days=3)
+
+# Recipe list and detail responses for anonymous users, dropped on any
+# recipe, tag, ingredient or author change. Shared caches (nginx) may keep
+# them for RECIPE_CACHE_MAX_AGE seconds.
+RECIPE_CACHE_TIMEOUT = 5 * 60
+RECIPE_CACHE_MAX_AGE = 60
+
+# Recipe image uploads and the resized variants (longest side in pixels)
+# rendered for them by IMAGE_WORKERS threads; 0 renders them right after
+# the commit, in the request thread.
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_VARIANTS = {'thumbnail': 320, 'medium': 960}
+IMAGE_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+# Share of requests measured by api.metrics, and how many runs of one
+# statement shape in a request count as a likely N+1.
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', default=0.05))
+METRICS_DUPLICATE_QUERIES = 3
+# Addresses or networks, comma-separated, that may scrape /metrics.
+METRICS_ALLOWED_IPS = [
+    network.strip() for network in os.getenv(
+        'METRICS_ALLOWED_IPS', default='127.0.0.1,::1'
+    ).split(',')
+    if network.strip()
+]
+
+# Query problem detectors run by api.detectors on a share of requests.
+# A statement shape issued QUERY_REPEAT_THRESHOLD times from one place is
+# an N+1; strict mode raises instead of logging (tests).
+QUERY_DETECTORS = [
+    'api.detectors.RepeatedQueryDetector',
+    'api.detectors.SlowQueryDetector',
+]
+QUERY_DETECTOR_SAMPLE_RATE = float(
+    os.getenv('QUERY_DETECTOR_SAMPLE_RATE', default=0.01)
+)
+QUERY_DETECTOR_STRICT = False
+QUERY_REPEAT_THRESHOLD = 3
+QUERY_SLOW_MS = int(os.getenv('QUERY_SLOW_MS', default=200))
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = 10
+INGREDIENT_AUTOCOMPLETE_MAX_LIMIT = 50
+
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
@@ -0,0 +1,128 @@
+import time
+import unittest
+from functools import partial
+from unittest import mock
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection
+from django.test import TestCase, override_settings
+
+from foodgram.db import base
+from foodgram.db.checks import check_connection_budget, check_engine
+
+postgresql_only = unittest.skipUnless(
+    connection.vendor == 'postgresql', 'PostgreSQL backend'
+)
+
+
+@postgresql_only
+class DatabaseBackendTests(TestCase):
+    def create_wrapper(self, alias='backend-test', **settings):
+        wrapper = base.DatabaseWrapper(
+            dict(connection.settings_dict, **settings), alias
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def terminate(self, pid):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+            for _ in range(100):
+                cursor.execute(
+                    'SELECT 1 FROM pg_stat_activity WHERE pid = %s', [pid]
+                )
+                if cursor.fetchone() is None:
+                    return
+                time.sleep(0.01)
+
+    def test_health_check_reconnects(self):
+        wrapper = self.create_wrapper(CONN_MAX_AGE=60)
+        wrapper.ensure_connection()
+        pid = wrapper.connection.get_backend_pid()
+        self.terminate(pid)
+        # A request boundary.
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertNotEqual(wrapper.connection.get_backend_pid(), pid)
+
+    def show_statement_timeout(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout')
+            return cursor.fetchone()[0]
+
+    def test_statement_timeout_while_serving(self):
+        wrapper = self.create_wrapper(STATEMENT_TIMEOUT=1500)
+        serving = partial(
+            mock.patch.object, base._local, 'serving', create=True
+        )
+        with serving(False):
+            self.assertEqual(self.show_statement_timeout(wrapper), '0')
+        # The connection is kept from before the request.
+        with serving(True):
+            self.assertEqual(self.show_statement_timeout(wrapper), '1500ms')
+        wrapper.close()
+        with serving(True):
+            self.assertEqual(self.show_statement_timeout(wrapper), '1500ms')
+        self.assertEqual(self.show_statement_timeout(wrapper), '0')
+
+    def test_statement_timeout_per_request(self):
+        settings = dict(POOL_SIZE=1, STATEMENT_TIMEOUT=1500)
+        self.addCleanup(lambda: base._pools.pop('pool-test').close())
+        wrapper = self.create_wrapper('pool-test', **settings)
+        with mock.patch.object(base._local, 'serving', True, create=True):
+            self.assertEqual(self.show_statement_timeout(wrapper), '1500ms')
+            wrapper.close()
+        # A worker thread gets the connection back without the timeout.
+        worker = self.create_wrapper('pool-test', **settings)
+        self.assertEqual(self.show_statement_timeout(worker), '0')
+
+    def test_pool(self):
+        settings = dict(POOL_SIZE=1, POOL_TIMEOUT=0.05)
+        self.addCleanup(lambda: base._pools.pop('pool-test').close())
+        first = self.create_wrapper('pool-test', **settings)
+        second = self.create_wrapper('pool-test', **settings)
+        with first.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT 1')
+        pid = first.connection.get_backend_pid()
+        with self.assertRaises(OperationalError):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        self.assertEqual(second.connection.get_backend_pid(), pid)
+        # Returned rolled back, not in the transaction left open.
+        self.assertEqual(
+            second.connection.get_transaction_status(),
+            base.extensions.TRANSACTION_STATUS_IDLE
+        )
+        second.close()
+        self.terminate(pid)
+        first.ensure_connection()
+        self.assertNotEqual(first.connection.get_backend_pid(), pid)
+
+    def test_connection_budget(self):
+        with override_settings(WEB_WORKERS=1, WEB_THREADS=1):
+            self.assertEqual(
+                check_connection_budget(databases=[DEFAULT_DB_ALIAS]), []
+            )
+        with override_settings(WEB_WORKERS=10000):
+            [warning] = check_connection_budget(
+                databases=[DEFAULT_DB_ALIAS]
+            )
+        self.assertEqual(warning.id, 'foodgram.W001')
+
+
+class EngineCheckTests(TestCase):
+    def test_stock_engine(self):
+        stock = dict(
+            connection.settings_dict,
+            ENGINE='django.db.backends.postgresql',
+            STATEMENT_TIMEOUT=1500,
+        )
+        with override_settings(DATABASES={DEFAULT_DB_ALIAS: stock}):
+            [warning] = check_engine()
+        self.assertEqual(warning.id, 'foodgram.W002')
+        with override_settings(DATABASES={
+            DEFAULT_DB_ALIAS: dict(stock, ENGINE='foodgram.db')
+        }):
+            self.assertEqual(check_engine(), [])
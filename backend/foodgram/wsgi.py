@@ -11,6 +11,12 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from api.checks import require_shared_cache
+from foodgram.db.checks import warn_connection_budget
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+require_shared_cache()
+warn_connection_budget()
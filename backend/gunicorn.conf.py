@@ -0,0 +1,53 @@
+"""
+Gunicorn settings of the backend container.
+
+WEB_WORKERS processes of WEB_THREADS threads each serve ``foodgram.wsgi``.
+Threads overlap the time requests wait on PostgreSQL. Every view is
+synchronous, so there is no ASGI mode: Django 3.2 would run those views of
+an ASGI worker on a single thread.
+
+The app is preloaded: settings, apps and URLs are imported once in the
+master and shared copy-on-write with the forked workers. WEB_WORKERS and
+WEB_THREADS are exported before that, so the cache and database connection
+checks see the same numbers.
+
+Workers only share cache invalidations, export jobs and ETags through a
+shared cache, so without CACHE_BACKEND pointing at one there is a single
+worker, and foodgram.wsgi refuses to start several.
+"""
+import multiprocessing
+import os
+
+SHARED_CACHE = os.getenv('CACHE_BACKEND', default='').endswith(
+    ('MemcacheCache', 'RedisCache', 'DatabaseCache', 'FileBasedCache')
+)
+os.environ.setdefault('WEB_WORKERS', str(
+    min(multiprocessing.cpu_count() * 2 + 1, 8) if SHARED_CACHE else 1
+))
+os.environ.setdefault('WEB_THREADS', '4')
+
+bind = os.getenv('BIND', default='0.0.0.0:8000')
+workers = int(os.environ['WEB_WORKERS'])
+threads = int(os.environ['WEB_THREADS'])
+wsgi_app = 'foodgram.wsgi:application'
+worker_class = 'gthread'
+preload_app = True
+
+timeout = int(os.getenv('WEB_TIMEOUT', default=30))
+graceful_timeout = 20
+# nginx reuses its upstream connections.
+keepalive = 5
+# Recycle workers now and then, staggered, to bound slow memory growth.
+max_requests = 2000
+max_requests_jitter = 200
+# Heartbeat files on tmpfs, not on the container's overlay filesystem.
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-' if os.getenv('WEB_ACCESS_LOG') else None
+errorlog = '-'
+
+
+def when_ready(server):
+    server.log.info(
+        'Serving foodgram.wsgi with %s workers x %s threads',
+        workers, threads
+    )
@@ -17,6 +17,7 @@ class UserAdmin(admin.ModelAdmin):
         'favorites',
         'following'
     )
+    list_display = ('username', 'email', 'recipes_count', 'followers_count')
     search_fields = ('email', 'username')
 
 
@@ -29,13 +30,11 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
     )
 
-    list_display = ('name', 'author', 'get_favorited_count')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
+    list_select_related = ('author',)
     search_fields = ('name', 'author')
     list_filter = ('tags',)
 
-    def get_favorited_count(self, obj):
-        return obj.recipe_fans.all().count()
-
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
@@ -0,0 +1,332 @@
+import io
+import math
+import random
+import time
+from bisect import bisect_left
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from PIL import Image
+
+from api.caching import bump_generation
+from recipes.management.commands.rebuild_counters import rebuild_counters
+from recipes.management.commands.update_recipe_scores import (
+    update_recipe_scores
+)
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.search import update_search_documents
+from users.models import User
+
+DATASET_IMAGE = 'recipes/images/dataset.jpg'
+WORDS = (
+    'борщ', 'суп', 'салат', 'пирог', 'котлеты', 'каша', 'блины', 'рагу',
+    'плов', 'омлет', 'паста', 'запеканка', 'гуляш', 'уха', 'сырники',
+    'томатный', 'грибной', 'куриный', 'овощной', 'сливочный', 'острый',
+    'домашний', 'быстрый', 'летний', 'зимний', 'пряный', 'сладкий',
+)
+ZIPF_EXPONENT = 1.1
+
+
+class Zipf:
+    """
+    Draw items with a Zipf-like popularity: the item at rank ``r`` is
+    picked with a weight of ``1 / (r + 1) ** ZIPF_EXPONENT``.
+    """
+
+    def __init__(self, items, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cumulative = list(accumulate(
+            1 / (rank + 1) ** ZIPF_EXPONENT
+            for rank in range(len(self.items))
+        ))
+        self.rng = rng
+
+    def sample(self, count, exclude=None):
+        """Up to ``count`` distinct items, popular ones more likely."""
+        count = min(count, len(self.items) - (exclude is not None))
+        picked = set()
+        total = self.cumulative[-1]
+        # Bounded, so tiny populations cannot spin forever.
+        for _ in range(count * 10):
+            if len(picked) >= count:
+                break
+            item = self.items[bisect_left(
+                self.cumulative, self.rng.random() * total
+            )]
+            if item != exclude:
+                picked.add(item)
+        return sorted(picked)
+
+
+def fan_out(rng, mean, limit):
+    """A log-normal count: most users have a few, some a great many."""
+    sigma = 1.0
+    mu = math.log(max(mean, 1)) - sigma ** 2 / 2
+    return min(int(rng.lognormvariate(mu, sigma)), limit)
+
+
+def insert(model, objects, batch_size):
+    """Bulk-insert an iterable in batches, never holding all of it."""
+    objects = iter(objects)
+    total = 0
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return total
+        model.objects.bulk_create(batch)
+        total += len(batch)
+
+
+def new_ids(queryset, after):
+    # SQLite does not return primary keys from bulk inserts on Django 3.2.
+    return list(
+        queryset.filter(pk__gt=after or 0)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
+
+
+def index_all():
+    update_search_documents()
+    return Recipe.objects.count()
+
+
+def ensure_image():
+    if not default_storage.exists(DATASET_IMAGE):
+        buffer = io.BytesIO()
+        Image.new('RGB', (960, 640), '#d9a066').save(buffer, 'JPEG')
+        default_storage.save(DATASET_IMAGE, ContentFile(buffer.getvalue()))
+
+
+def generate_dataset(users, recipes, seed=0, prefix='load', tags=12,
+                     ingredients=500, author_share=0.2, follows=20,
+                     favorites=15, cart=4, password='load-pass-42',
+                     batch_size=5000, report=None):
+    """
+    Insert a synthetic dataset and return the number of rows per table.
+
+    The same arguments on an empty database give the same rows. Follows,
+    favorites and carts pick popular authors and recipes far more often,
+    with log-normal per-user counts around ``follows``, ``favorites`` and
+    ``cart``. Counters, scores and search documents are rebuilt at the
+    end, as the bulk inserts bypass signals.
+    """
+    rng = random.Random(seed)
+    report = report or (lambda step, rows, seconds: None)
+    counts = {}
+
+    def step(name, func):
+        start = time.perf_counter()
+        counts[name] = func()
+        report(name, counts[name], time.perf_counter() - start)
+
+    if User.objects.filter(username__startswith=prefix).exists():
+        raise CommandError(
+            'Users named {}* exist already, pick another --prefix.'.format(
+                prefix
+            )
+        )
+    ensure_image()
+    with transaction.atomic():
+        tag_ids = list(
+            Tag.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        step('tags', lambda: insert(Tag, (
+            Tag(
+                name='{} тег {}'.format(prefix, number),
+                color='#{:06X}'.format(rng.randrange(1 << 24)),
+                slug='{}-tag-{}'.format(prefix, number),
+            )
+            for number in range(len(tag_ids), tags)
+        ), batch_size))
+        tag_ids = list(
+            Tag.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        existing = Ingredient.objects.count()
+        step('ingredients', lambda: insert(Ingredient, (
+            Ingredient(
+                name='{} ингредиент {}'.format(prefix, number),
+                measurement_unit=rng.choice(('г', 'мл', 'шт.')),
+            )
+            for number in range(existing, ingredients)
+        ), batch_size))
+        ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if len(ingredient_ids) < 30:
+            raise CommandError('Recipes need at least 30 ingredients.')
+
+        last_user = User.objects.aggregate(last=Max('pk'))['last']
+        hashed = make_password(password)
+        step('users', lambda: insert(User, (
+            User(
+                username='{}{}'.format(prefix, number),
+                email='{}{}@dataset.local'.format(prefix, number),
+                first_name=rng.choice(WORDS).capitalize(),
+                last_name='Тестовый',
+                password=hashed,
+            )
+            for number in range(users)
+        ), batch_size))
+        user_ids = new_ids(User.objects, last_user)
+        authors = Zipf(
+            user_ids[:max(1, int(len(user_ids) * author_share))], rng
+        )
+
+        def follow_rows():
+            for user_id in user_ids:
+                count = fan_out(rng, follows, len(authors.items))
+                for author_id in authors.sample(count, exclude=user_id):
+                    yield User.following.through(
+                        from_user_id=user_id, to_user_id=author_id
+                    )
+
+        step('follows', lambda: insert(
+            User.following.through, follow_rows(), batch_size
+        ))
+
+        last_recipe = Recipe.objects.aggregate(last=Max('pk'))['last']
+        author_picks = authors.cumulative
+        step('recipes', lambda: insert(Recipe, (
+            Recipe(
+                name='{} {} {}'.format(
+                    rng.choice(WORDS[:15]).capitalize(),
+                    rng.choice(WORDS[15:]),
+                    number,
+                ),
+                author_id=authors.items[bisect_left(
+                    author_picks, rng.random() * author_picks[-1]
+                )],
+                image=DATASET_IMAGE,
+                text=' '.join(rng.choices(WORDS, k=20)),
+                cooking_time=rng.randint(5, 180),
+            )
+            for number in range(recipes)
+        ), batch_size))
+        recipe_ids = new_ids(Recipe.objects, last_recipe)
+
+        step('recipe tags', lambda: insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(tag_ids, min(
+                len(tag_ids), rng.randint(1, 3)
+            ))
+        ), batch_size))
+        step('recipe ingredients', lambda: insert(IngredientRecipe, (
+            IngredientRecipe(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(
+                ingredient_ids, rng.randint(5, 30)
+            )
+        ), batch_size))
+
+        popular = Zipf(recipe_ids, rng)
+
+        def collection_rows(through, mean):
+            for user_id in user_ids:
+                count = fan_out(rng, mean, len(recipe_ids))
+                for recipe_id in popular.sample(count):
+                    yield through(user_id=user_id, recipe_id=recipe_id)
+
+        step('favorites', lambda: insert(
+            User.favorites.through,
+            collection_rows(User.favorites.through, favorites),
+            batch_size
+        ))
+        step('shopping carts', lambda: insert(
+            User.shopping_cart.through,
+            collection_rows(User.shopping_cart.through, cart),
+            batch_size
+        ))
+
+        step('counters', lambda: sum(rebuild_counters()))
+        step('scores', lambda: update_recipe_scores(all_recipes=True)[1])
+        step('search', index_all)
+    for name in ('tags', 'ingredients', 'recipes', 'recipe-ingredients'):
+        bump_generation(name)
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Insert a deterministic synthetic dataset at production scale: '
+        'users with a follow graph, recipes with tags and 5-30 ingredients, '
+        'favorites and shopping carts. Users log in with --password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Prefix of the generated usernames, tags and ingredients.'
+        )
+        parser.add_argument(
+            '--tags', type=int, default=12,
+            help='Create tags until there are this many.'
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=500,
+            help='Create ingredients until there are this many.'
+        )
+        parser.add_argument(
+            '--author-share', type=float, default=0.2,
+            help='Share of the users that publish recipes.'
+        )
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Mean subscriptions per user.'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=15,
+            help='Mean favorites per user.'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=4,
+            help='Mean shopping cart recipes per user.'
+        )
+        parser.add_argument('--password', default='load-pass-42')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        def report(step, rows, seconds):
+            self.stdout.write('{:<20} {:>10} rows {:>8.1f} s'.format(
+                step, rows, seconds
+            ))
+
+        start = time.perf_counter()
+        counts = generate_dataset(
+            options['users'],
+            options['recipes'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+            tags=options['tags'],
+            ingredients=options['ingredients'],
+            author_share=options['author_share'],
+            follows=options['follows'],
+            favorites=options['favorites'],
+            cart=options['cart'],
+            password=options['password'],
+            batch_size=options['batch_size'],
+            report=report,
+        )
+        inserted = sum(
+            rows for step, rows in counts.items()
+            if step not in ('counters', 'scores', 'search')
+        )
+        self.stdout.write(self.style.SUCCESS(
+            '{} rows inserted in {:.1f} s'.format(
+                inserted, time.perf_counter() - start
+            )
+        ))
@@ -0,0 +1,137 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.caching import bump_generation
+from recipes.models import Ingredient
+
+CSV_HEADER = ['name', 'measurement_unit']
+
+
+def read_json(file, chunk_size=1 << 16):
+    """
+    Yield the objects of a top-level JSON array one by one, reading the
+    file in chunks instead of loading it whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Expected a JSON array.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            if buffer[position] != '{':
+                raise CommandError('Expected a JSON array of objects.')
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise CommandError('Malformed JSON near character {}.'
+                                       .format(position))
+            else:
+                yield item
+                continue
+        if eof:
+            raise CommandError('Unexpected end of the JSON file.')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def read_csv(file):
+    for number, row in enumerate(csv.reader(file)):
+        if number == 0 and row == CSV_HEADER:
+            continue
+        if len(row) != 2:
+            raise CommandError(
+                'Line {}: expected name and measurement unit.'
+                .format(number + 1)
+            )
+        yield {'name': row[0], 'measurement_unit': row[1]}
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream ingredients from a JSON or CSV file and insert the missing '
+        'ones in batches. Safe to run again on the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(
+                settings.BASE_DIR, 'data', 'ingredients.json'
+            ),
+            help='JSON array of {name, measurement_unit} objects or a CSV '
+                 'file with name,measurement_unit rows.'
+        )
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='File format, guessed from the extension by default.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in ('json', 'csv'):
+            raise CommandError('Unknown file format: {}.'.format(path))
+        reader = read_json if file_format == 'json' else read_csv
+
+        initial = Ingredient.objects.count()
+        processed = 0
+        start = time.perf_counter()
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = reader(file)
+            while True:
+                chunk = list(islice(rows, options['batch_size']))
+                if not chunk:
+                    break
+                batch = {
+                    (row['name'].strip(), row['measurement_unit'].strip())
+                    for row in chunk
+                }
+                # (name, measurement_unit) is unique and is the whole row,
+                # so skipping conflicts is an upsert.
+                Ingredient.objects.bulk_create(
+                    (
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in batch
+                    ),
+                    ignore_conflicts=True,
+                )
+                processed += len(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write('{} rows'.format(processed))
+        elapsed = time.perf_counter() - start
+        created = Ingredient.objects.count() - initial
+        # Bulk inserts bypass the post_save signal.
+        bump_generation('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            '{} rows read, {} ingredients added in {:.2f} s ({:.0f} rows/s)'
+            .format(
+                processed,
+                created,
+                elapsed,
+                processed / elapsed if elapsed else 0
+            )
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Recipe
+from users.models import User
+
+
+def count_of(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('*'))
+            .values('total')
+        ),
+        0
+    )
+
+
+def rebuild_counters():
+    with transaction.atomic():
+        recipes = Recipe.objects.update(
+            favorites_count=count_of(User.favorites.through, 'recipe'),
+            in_carts_count=count_of(User.shopping_cart.through, 'recipe'),
+        )
+        users = User.objects.update(
+            recipes_count=count_of(Recipe, 'author'),
+            followers_count=count_of(User.following.through, 'to_user'),
+        )
+    return recipes, users
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the favorites, shopping cart, recipes and followers '
+        'counters from the relation tables.'
+    )
+
+    def handle(self, *args, **options):
+        recipes, users = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(
+            'Counters rebuilt for {} recipes and {} users'.format(
+                recipes, users
+            )
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.search import update_search_documents
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the full-text search documents of all recipes, e.g. after '
+        'bulk imports that bypass signals.'
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            update_search_documents()
+        self.stdout.write(self.style.SUCCESS(
+            '{} recipes indexed in {:.2f} s'.format(
+                Recipe.objects.count(), time.perf_counter() - start
+            )
+        ))
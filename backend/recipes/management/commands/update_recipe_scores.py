@@ -0,0 +1,108 @@
+import math
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from api.caching import bump_generation
+from recipes.models import Recipe, RecipeActivity, RecipeScore
+
+
+def log_add_exp(a, b):
+    """``log(exp(a) + exp(b))`` without overflowing."""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def update_recipe_scores(all_recipes=False, batch_size=1000):
+    """
+    Fold the queued activity into the recipe scores and drop it.
+
+    Trending scores only grow: an addition at time ``t`` contributes
+    ``weight * exp(decay * (t - epoch))`` in log space. Popularity is
+    recomputed from the counters of every recipe with activity, or of all
+    recipes with ``all_recipes``. Returns the number of events and of
+    updated scores.
+    """
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    epoch = settings.RECIPE_SCORE_EPOCH
+    decay = math.log(2) / settings.RECIPE_TRENDING_HALF_LIFE.total_seconds()
+    with transaction.atomic():
+        last = RecipeActivity.objects.aggregate(last=Max('id'))['last']
+        events = RecipeActivity.objects.filter(id__lte=last or 0)
+        terms = {}
+        for recipe_id, kind, added, created in events.values_list(
+            'recipe_id', 'kind', 'added', 'created'
+        ).iterator():
+            recipe_terms = terms.setdefault(recipe_id, [])
+            if added:
+                recipe_terms.append(
+                    math.log(weights[kind])
+                    + decay * (created - epoch).total_seconds()
+                )
+        recipes = Recipe.objects.all()
+        if not all_recipes:
+            recipes = recipes.filter(pk__in=list(terms))
+        recipes = recipes.values_list(
+            'pk', 'favorites_count', 'in_carts_count', 'score__trending'
+        ).order_by('pk')
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(recipes.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            scores = []
+            for pk, favorites, in_carts, trending in batch:
+                recipe_terms = terms.get(pk, [])
+                if trending:
+                    recipe_terms.append(trending)
+                for term in recipe_terms[1:]:
+                    recipe_terms[0] = log_add_exp(recipe_terms[0], term)
+                scores.append(RecipeScore(
+                    recipe_id=pk,
+                    popular=(
+                        weights['favorite'] * favorites
+                        + weights['shopping_cart'] * in_carts
+                    ),
+                    trending=recipe_terms[0] if recipe_terms else 0,
+                ))
+            # Recipes bulk-created without signals have no score yet.
+            RecipeScore.objects.bulk_create(scores, ignore_conflicts=True)
+            RecipeScore.objects.bulk_update(
+                scores, ['popular', 'trending']
+            )
+            updated += len(scores)
+        deleted, _ = events.delete()
+        if updated:
+            # Ranked feeds are in the anonymous recipe cache.
+            transaction.on_commit(partial(bump_generation, 'recipes'))
+    return deleted, updated
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold queued favorite and shopping cart activity into the '
+        'popular and trending recipe scores. Run it periodically, e.g. '
+        'from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute popularity of every recipe, e.g. after '
+                 'changing RECIPE_SCORE_WEIGHTS or bulk imports.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        events, scores = update_recipe_scores(
+            options['all'], options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            '{} events folded, {} scores updated'.format(events, scores)
+        ))
@@ -0,0 +1,95 @@
+# Generated by Django 3.2.17 on 2026-10-18 17:51
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.functions.text
+
+# Prefix (istartswith) and substring (icontains) ingredient searches compare
+# UPPER(name) with LIKE, which needs pattern operator classes on PostgreSQL.
+LIKE_INDEX = (
+    'CREATE INDEX ingredient_name_upper_like_idx ON recipes_ingredient '
+    '(UPPER(name::text) text_pattern_ops)'
+)
+TRIGRAM_INDEX = (
+    'CREATE INDEX ingredient_name_upper_trgm_idx ON recipes_ingredient '
+    'USING gin (UPPER(name::text) gin_trgm_ops)'
+)
+
+
+def has_extension(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_available_extensions WHERE name = %s', [name]
+        )
+        return cursor.fetchone() is not None
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(LIKE_INDEX)
+    # pg_trgm ships with the contrib package, which some servers lack.
+    if has_extension(schema_editor, 'pg_trgm'):
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(TRIGRAM_INDEX)
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_upper_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_upper_like_idx')
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Sum the amounts of an ingredient listed twice in one recipe."""
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = (
+        IngredientRecipe.objects
+        .values('recipe', 'ingredient')
+        .annotate(rows=Count('id'), total=Sum('amount'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        rows = IngredientRecipe.objects.filter(
+            recipe=duplicate['recipe'],
+            ingredient=duplicate['ingredient']
+        ).order_by('id')
+        first = rows[0]
+        rows.exclude(pk=first.pk).delete()
+        first.amount = duplicate['total']
+        first.save(update_fields=['amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_alter_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ('-id',)},
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.functions.text.Upper('slug'), name='tag_slug_upper_idx'),
+        ),
+        migrations.RunPython(
+            merge_duplicate_ingredients,
+            migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_recipe'),
+        ),
+        migrations.RunPython(
+            create_postgres_indexes,
+            drop_postgres_indexes
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.17 on 2026-10-18 17:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Keep the oldest of ingredients sharing a name and measurement unit and
+    move the recipes that use the others over to it.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = (
+        Ingredient.objects
+        .values('name', 'measurement_unit')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        ids = list(
+            Ingredient.objects.filter(
+                name=duplicate['name'],
+                measurement_unit=duplicate['measurement_unit']
+            ).order_by('id').values_list('id', flat=True)
+        )
+        kept, removed = ids[0], ids[1:]
+        for row in IngredientRecipe.objects.filter(ingredient__in=removed):
+            existing = IngredientRecipe.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=kept
+            ).first()
+            if existing is None:
+                row.ingredient_id = kept
+                row.save(update_fields=['ingredient'])
+            else:
+                existing.amount += row.amount
+                existing.save(update_fields=['amount'])
+                row.delete()
+        Ingredient.objects.filter(id__in=removed).delete()
+    if duplicates and schema_editor.connection.vendor == 'postgresql':
+        # The deletes queued deferred foreign key checks, and PostgreSQL
+        # refuses to alter a table with pending trigger events.
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients,
+            migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.17 on 2026-10-18 18:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_scores(apps, schema_editor):
+    """Start every recipe with its all-time popularity and no trend."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    RecipeScore.objects.bulk_create(
+        (
+            RecipeScore(
+                recipe_id=pk,
+                popular=(
+                    weights['favorite'] * favorites
+                    + weights['shopping_cart'] * in_carts
+                ),
+            )
+            for pk, favorites, in_carts in Recipe.objects.values_list(
+                'pk', 'favorites_count', 'in_carts_count'
+            ).iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('favorite', 'В избранном'), ('shopping_cart', 'В списке покупок')], max_length=16)),
+                ('added', models.BooleanField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe')),
+                ('popular', models.FloatField(default=0)),
+                ('trending', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popular', '-recipe'], name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipe_score_trending_idx'),
+        ),
+        migrations.AddField(
+            model_name='recipeactivity',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe'),
+        ),
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.17 on 2026-10-18 18:30
+
+from django.db import migrations
+
+POSTGRES_TABLE = (
+    'CREATE TABLE recipes_recipe_search ('
+    'recipe_id bigint PRIMARY KEY REFERENCES recipes_recipe (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)'
+)
+POSTGRES_INDEX = (
+    'CREATE INDEX recipe_search_document_idx ON recipes_recipe_search '
+    'USING gin (document)'
+)
+POSTGRES_FILL = '''
+    INSERT INTO recipes_recipe_search (recipe_id, document)
+    SELECT
+        recipe.id,
+        setweight(to_tsvector('russian', recipe.name), 'A')
+        || setweight(to_tsvector(
+            'russian', coalesce(string_agg(ingredient.name, ' '), '')
+        ), 'B')
+        || setweight(to_tsvector('russian', recipe.text), 'C')
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientrecipe link ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    GROUP BY recipe.id
+'''
+SQLITE_TABLE = (
+    'CREATE VIRTUAL TABLE recipes_recipe_search '
+    'USING fts5(name, ingredients, text, tokenize=unicode61)'
+)
+SQLITE_FILL = '''
+    INSERT INTO recipes_recipe_search (rowid, name, ingredients, text)
+    SELECT
+        recipe.id,
+        recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''),
+        recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientrecipe link ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    GROUP BY recipe.id
+'''
+
+
+def create_search_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_TABLE)
+        schema_editor.execute(POSTGRES_INDEX)
+        schema_editor.execute(POSTGRES_FILL)
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE)
+        schema_editor.execute(SQLITE_FILL)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE IF EXISTS recipes_recipe_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_scores'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
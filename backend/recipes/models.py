@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 from users.models import User
 
@@ -15,6 +18,14 @@ class Ingredient(models.Model):
         blank=False
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
+
     def __str__(self):
         return self.name
 
@@ -35,10 +46,43 @@ class Tag(models.Model):
         unique=True
     )
 
+    class Meta:
+        indexes = [
+            # The recipe list filters tags with slug__iexact.
+            models.Index(Upper('slug'), name='tag_slug_upper_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        """
+        Annotate ``is_favorited`` and ``is_in_shopping_cart`` for ``user``
+        so serializers do not have to query them per recipe.
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                User.favorites.through.objects.filter(
+                    user=user,
+                    recipe=OuterRef('pk')
+                )
+            ),
+            is_in_shopping_cart=Exists(
+                User.shopping_cart.through.objects.filter(
+                    user=user,
+                    recipe=OuterRef('pk')
+                )
+            ),
+        )
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=200, null=False, blank=False)
     tags = models.ManyToManyField(
@@ -58,6 +102,24 @@ class Recipe(models.Model):
         )
     text = models.TextField(null=False, blank=False)
     cooking_time = models.IntegerField()
+    # Resized copies of ``image``, written by api.images.
+    image_variants = models.JSONField(default=dict, editable=False)
+    # Version of the recipe for ETags, moved on by every save.
+    modified = models.DateTimeField(auto_now=True)
+    # Maintained by recipes.signals, rebuilt by rebuild_counters.
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-id',)
+        indexes = [
+            models.Index(
+                fields=['author', '-id'],
+                name='recipe_author_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -75,3 +137,63 @@ class IngredientRecipe(models.Model):
         related_name='ingredients'
     )
     amount = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique_ingredient_recipe'
+            )
+        ]
+
+
+class RecipeScore(models.Model):
+    """
+    Precomputed ranks of the popular and trending feeds, updated by the
+    update_recipe_scores command.
+
+    ``trending`` is the natural log of the favorite and shopping cart
+    additions, each weighted by ``exp(decay * (added - epoch))``. Scaling
+    every score by the same ``exp(-decay * (now - epoch))`` does not
+    change the order, so new additions are simply added in and old scores
+    never need to be decayed.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score'
+    )
+    popular = models.FloatField(default=0)
+    trending = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-popular', '-recipe'],
+                name='recipe_score_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending', '-recipe'],
+                name='recipe_score_trending_idx'
+            ),
+        ]
+
+
+class RecipeActivity(models.Model):
+    """Favorite and shopping cart changes not yet folded into scores."""
+    FAVORITE = 'favorite'
+    SHOPPING_CART = 'shopping_cart'
+    KINDS = (
+        (FAVORITE, 'В избранном'),
+        (SHOPPING_CART, 'В списке покупок'),
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    kind = models.CharField(max_length=16, choices=KINDS)
+    added = models.BooleanField()
+    created = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,150 @@
+"""
+Full-text recipe search.
+
+Every recipe has a search document in ``recipes_recipe_search`` built from
+its name, ingredient names and text, weighted in that order. On
+PostgreSQL the document is a ``tsvector`` with a GIN index; on SQLite it
+is a row of an FTS5 table ranked with ``bm25``. The table is created by
+migration 0010 and kept up to date by ``recipes.signals``.
+"""
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'recipes_recipe_search'
+SEARCH_CONFIG = 'russian'
+# bm25 column weights of name, ingredients and text on SQLite.
+FTS5_WEIGHTS = (10.0, 4.0, 1.0)
+
+POSTGRES_UPSERT = '''
+    INSERT INTO recipes_recipe_search (recipe_id, document)
+    SELECT
+        recipe.id,
+        setweight(to_tsvector(%(config)s, recipe.name), 'A')
+        || setweight(to_tsvector(
+            %(config)s, coalesce(string_agg(ingredient.name, ' '), '')
+        ), 'B')
+        || setweight(to_tsvector(%(config)s, recipe.text), 'C')
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientrecipe link ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    {where}
+    GROUP BY recipe.id
+    ON CONFLICT (recipe_id) DO UPDATE SET document = EXCLUDED.document
+'''
+SQLITE_INSERT = '''
+    INSERT INTO recipes_recipe_search (rowid, name, ingredients, text)
+    SELECT
+        recipe.id,
+        recipe.name,
+        coalesce(group_concat(ingredient.name, ' '), ''),
+        recipe.text
+    FROM recipes_recipe recipe
+    LEFT JOIN recipes_ingredientrecipe link ON link.recipe_id = recipe.id
+    LEFT JOIN recipes_ingredient ingredient
+        ON ingredient.id = link.ingredient_id
+    {where}
+    GROUP BY recipe.id
+'''
+
+
+def update_search_documents(recipe_ids=None):
+    """
+    Rebuild the search documents of the given recipes, or of all recipes
+    when ``recipe_ids`` is None, in one statement per backend.
+    """
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            where = '' if recipe_ids is None else (
+                'WHERE recipe.id = ANY(%(ids)s)'
+            )
+            cursor.execute(
+                POSTGRES_UPSERT.format(where=where),
+                {'config': SEARCH_CONFIG, 'ids': recipe_ids}
+            )
+        elif vendor == 'sqlite':
+            if recipe_ids is None:
+                cursor.execute('DELETE FROM recipes_recipe_search')
+                where = ''
+            else:
+                placeholders = ', '.join(['%s'] * len(recipe_ids))
+                cursor.execute(
+                    'DELETE FROM recipes_recipe_search '
+                    'WHERE rowid IN ({})'.format(placeholders),
+                    recipe_ids
+                )
+                where = 'WHERE recipe.id IN ({})'.format(placeholders)
+            cursor.execute(SQLITE_INSERT.format(where=where), recipe_ids)
+
+
+def delete_search_documents(recipe_ids):
+    """PostgreSQL cascades the delete, the FTS5 table has no foreign key."""
+    if connection.vendor == 'sqlite' and recipe_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM recipes_recipe_search WHERE rowid IN ({})'.format(
+                    ', '.join(['%s'] * len(recipe_ids))
+                ),
+                list(recipe_ids)
+            )
+
+
+def fts5_query(query):
+    """Match every word of ``query``, each quoted to escape FTS5 syntax."""
+    return ' '.join(
+        '"{}"'.format(word.replace('"', '""')) for word in query.split()
+    )
+
+
+def search_recipes(queryset, query):
+    """
+    Recipes of ``queryset`` matching ``query``, annotated with a
+    ``relevance`` score (higher is better).
+    """
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        match = RawSQL(
+            'SELECT recipe_id FROM recipes_recipe_search '
+            'WHERE document @@ websearch_to_tsquery(%s, %s)',
+            (SEARCH_CONFIG, query)
+        )
+        relevance = RawSQL(
+            # float8: cursors compare the rank with its exact repr.
+            'SELECT ts_rank(document, websearch_to_tsquery(%s, %s))::float8 '
+            'FROM recipes_recipe_search '
+            'WHERE recipe_id = recipes_recipe.id',
+            (SEARCH_CONFIG, query),
+            output_field=FloatField()
+        )
+    elif vendor == 'sqlite':
+        query = fts5_query(query)
+        if not query:
+            return queryset.none()
+        # One MATCH joined to the recipes: the bm25 of a correlated
+        # subquery would run the full-text query again for every row.
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[
+                '{0}.rowid = recipes_recipe.id AND {0} MATCH %s'.format(
+                    SEARCH_TABLE
+                ),
+            ],
+            params=[query],
+        ).annotate(relevance=RawSQL(
+            '-bm25({}, {}, {}, {})'.format(SEARCH_TABLE, *FTS5_WEIGHTS),
+            (),
+            output_field=FloatField()
+        ))
+    else:
+        return queryset.filter(
+            Q(name__icontains=query)
+            | Q(text__icontains=query)
+            | Q(ingredients__ingredient__name__icontains=query)
+        ).distinct()
+    return queryset.filter(pk__in=match).annotate(relevance=relevance)
@@ -0,0 +1,189 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from users.models import User
+from .models import (
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeActivity,
+    RecipeScore,
+)
+from .search import delete_search_documents, update_search_documents
+
+# through model -> (counted model, its foreign key on the through model,
+# the other foreign key, counter field)
+M2M_COUNTERS = {
+    User.favorites.through: (Recipe, 'recipe', 'user', 'favorites_count'),
+    User.shopping_cart.through: (
+        Recipe, 'recipe', 'user', 'in_carts_count'
+    ),
+    User.following.through: (
+        User, 'to_user', 'from_user', 'followers_count'
+    ),
+}
+
+
+def decrement_links(through, links):
+    """Decrease the counters of the objects that ``links`` point to."""
+    model, counted, _, counter = M2M_COUNTERS[through]
+    model.objects.filter(pk__in=links.values(counted)).update(**{
+        counter: F(counter) - Coalesce(
+            Subquery(
+                links
+                .filter(**{counted: OuterRef('pk')})
+                .order_by()
+                .values(counted)
+                .annotate(total=Count('*'))
+                .values('total')
+            ),
+            0
+        )
+    })
+
+
+def update_m2m_counter(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep a counter in step with a many-to-many relation, in both
+    directions. Additions use the ``pk_set`` of ``post_add``, which holds
+    only the new links; removals are counted from the through table before
+    the rows go, since ``remove()`` reports every requested id.
+    """
+    model, counted, other, counter = M2M_COUNTERS[sender]
+    if action == 'post_add' and pk_set:
+        if reverse:
+            model.objects.filter(pk=instance.pk).update(
+                **{counter: F(counter) + len(pk_set)}
+            )
+        else:
+            model.objects.filter(pk__in=pk_set).update(
+                **{counter: F(counter) + 1}
+            )
+    elif action in ('pre_remove', 'pre_clear'):
+        instance_field, pk_field = (
+            (counted, other) if reverse else (other, counted)
+        )
+        links = sender.objects.filter(**{instance_field: instance})
+        if action == 'pre_remove':
+            links = links.filter(**{pk_field + '__in': pk_set})
+        decrement_links(sender, links)
+
+
+for through in M2M_COUNTERS:
+    m2m_changed.connect(
+        update_m2m_counter,
+        sender=through,
+        dispatch_uid='counter:{}'.format(through._meta.label),
+    )
+
+ACTIVITY_KINDS = {
+    User.favorites.through: RecipeActivity.FAVORITE,
+    User.shopping_cart.through: RecipeActivity.SHOPPING_CART,
+}
+
+
+def log_activity(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Queue favorite and shopping cart changes for update_recipe_scores.
+    Every addition is an event; for removals one event per recipe is
+    enough to have its popularity recomputed.
+    """
+    if action == 'post_add' and pk_set:
+        recipe_ids = [instance.pk] * len(pk_set) if reverse else pk_set
+    elif action == 'post_remove' and pk_set:
+        recipe_ids = [instance.pk] if reverse else pk_set
+    elif action == 'pre_clear':
+        recipe_ids = [instance.pk] if reverse else list(
+            sender.objects
+            .filter(user=instance)
+            .values_list('recipe_id', flat=True)
+        )
+    else:
+        return
+    RecipeActivity.objects.bulk_create(
+        RecipeActivity(
+            recipe_id=pk,
+            kind=ACTIVITY_KINDS[sender],
+            added=action == 'post_add',
+        )
+        for pk in recipe_ids
+    )
+
+
+for through in ACTIVITY_KINDS:
+    m2m_changed.connect(
+        log_activity,
+        sender=through,
+        dispatch_uid='activity:{}'.format(through._meta.label),
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def set_up_created_recipe(instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(instance, **kwargs):
+    User.objects.filter(pk=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(pre_delete, sender=User)
+def uncount_deleted_user(instance, **kwargs):
+    """The cascade removes the user's links without ``m2m_changed``."""
+    for through, (_, _, other, _) in M2M_COUNTERS.items():
+        decrement_links(through, through.objects.filter(**{other: instance}))
+    for through in ACTIVITY_KINDS:
+        log_activity(through, instance, 'pre_clear', False, None)
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_search_document(instance, **kwargs):
+    # After commit, once the write path has stored the ingredients too.
+    # Receivers on IngredientRecipe would cost the bulk writes their fast
+    # deletes; every API change of ingredients saves the recipe anyway.
+    transaction.on_commit(partial(update_search_documents, [instance.pk]))
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_search_documents(instance, created, **kwargs):
+    if created:
+        return
+    transaction.on_commit(lambda: update_search_documents(
+        IngredientRecipe.objects
+        .filter(ingredient=instance)
+        .values_list('recipe_id', flat=True)
+    ))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def refresh_deleted_ingredient_search_documents(instance, **kwargs):
+    # Collected now: the cascade deletes the links before the commit.
+    recipe_ids = list(
+        IngredientRecipe.objects
+        .filter(ingredient=instance)
+        .values_list('recipe_id', flat=True)
+    )
+    if recipe_ids:
+        transaction.on_commit(partial(update_search_documents, recipe_ids))
+
+
+@receiver(post_delete, sender=Recipe)
+def drop_search_document(instance, **kwargs):
+    delete_search_documents([instance.pk])
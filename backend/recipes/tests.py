@@ -1,3 +1,260 @@
+import io
+import math
+import tempfile
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Count
 from django.test import TestCase
+from django.utils import timezone
+
+from recipes.management.commands.generate_dataset import generate_dataset
+from recipes.management.commands.import_ingredients import read_json
+from recipes.management.commands.update_recipe_scores import (
+    update_recipe_scores
+)
+from recipes.models import Ingredient, Recipe, RecipeActivity, RecipeScore
+from users.models import User
+
+
+class ImportIngredientsTests(TestCase):
+    def import_file(self, content, suffix):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8'
+        ) as file:
+            file.write(content)
+            file.flush()
+            call_command(
+                'import_ingredients',
+                file.name,
+                batch_size=2,
+                stdout=io.StringIO()
+            )
+
+    def test_read_json_in_small_chunks(self):
+        content = (
+            '[{"name": "мука", "measurement_unit": "г"},\n'
+            ' {"name": "молоко, 3.2%", "measurement_unit": "мл"}]'
+        )
+        self.assertEqual(
+            [row['name'] for row in read_json(io.StringIO(content), 7)],
+            ['мука', 'молоко, 3.2%']
+        )
+
+    def test_import_is_idempotent(self):
+        content = 'name,measurement_unit\nмука,г\nсоль,г\nмука,г\nвода,мл\n'
+        self.import_file(content, '.csv')
+        self.import_file(content, '.csv')
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_import_json(self):
+        self.import_file(
+            '[{"name": "мука", "measurement_unit": "г"}]', '.json'
+        )
+        self.assertTrue(
+            Ingredient.objects.filter(name='мука', measurement_unit='г')
+            .exists()
+        )
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create(
+                username='user{}'.format(number),
+                email='user{}@foodgram.test'.format(number),
+            )
+            for number in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                name='Рецепт {}'.format(number),
+                author=cls.users[0],
+                image='recipes/images/test.gif',
+                text='Описание',
+                cooking_time=5,
+            )
+            for number in range(3)
+        ]
+
+    def assertCounters(self):
+        """Stored counters match the relations they count."""
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                recipe.favorites_count, recipe.recipe_fans.count()
+            )
+            self.assertEqual(recipe.in_carts_count, recipe.shoppers.count())
+        for user in User.objects.all():
+            self.assertEqual(user.recipes_count, user.recipes.count())
+            self.assertEqual(user.followers_count, user.followers.count())
+
+    def test_recipes_count(self):
+        self.assertEqual(
+            User.objects.get(pk=self.users[0].pk).recipes_count, 3
+        )
+        self.recipes[0].delete()
+        self.assertCounters()
+
+    def test_add_and_remove(self):
+        user = self.users[1]
+        user.favorites.add(*self.recipes)
+        user.favorites.add(self.recipes[0])
+        user.favorites.remove(self.recipes[0], self.recipes[0])
+        user.shopping_cart.set(self.recipes[1:])
+        user.following.add(self.users[0], self.users[2])
+        user.following.remove(self.users[2])
+        self.assertCounters()
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[1].pk).favorites_count, 1
+        )
+
+    def test_reverse_and_clear(self):
+        self.recipes[0].recipe_fans.add(*self.users)
+        self.recipes[0].shoppers.set(self.users[:2])
+        self.users[0].followers.add(self.users[1], self.users[2])
+        self.assertCounters()
+        self.users[1].favorites.clear()
+        self.recipes[0].shoppers.clear()
+        self.users[0].followers.remove(self.users[1])
+        self.assertCounters()
+
+    def test_user_deletion(self):
+        user = self.users[2]
+        user.favorites.add(*self.recipes)
+        user.following.add(self.users[1])
+        user.delete()
+        self.assertCounters()
+
+    def test_rebuild(self):
+        self.users[1].favorites.add(*self.recipes)
+        Recipe.objects.update(favorites_count=0, in_carts_count=5)
+        User.objects.update(recipes_count=0)
+        call_command('rebuild_counters', stdout=io.StringIO())
+        self.assertCounters()
+
+
+class RecipeScoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@foodgram.test'
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт',
+            author=cls.user,
+            image='recipes/images/test.gif',
+            text='Описание',
+            cooking_time=5,
+        )
+
+    def add_events(self, *days_ago):
+        now = timezone.now()
+        RecipeActivity.objects.bulk_create(
+            RecipeActivity(
+                recipe=self.recipe,
+                kind=RecipeActivity.FAVORITE,
+                added=True,
+                created=now - timedelta(days=days),
+            )
+            for days in days_ago
+        )
+
+    def test_incremental_fold(self):
+        self.add_events(9, 3)
+        update_recipe_scores()
+        self.add_events(0)
+        update_recipe_scores()
+        incremental = RecipeScore.objects.get(recipe=self.recipe).trending
+        self.add_events(9, 3, 0)
+        RecipeScore.objects.update(trending=0)
+        update_recipe_scores()
+        self.assertAlmostEqual(
+            RecipeScore.objects.get(recipe=self.recipe).trending, incremental
+        )
+        self.assertFalse(RecipeActivity.objects.exists())
+
+    def test_decay(self):
+        """Three additions one half-life ago weigh as much as 1.5 today."""
+        self.add_events(3, 3, 3)
+        update_recipe_scores()
+        old = RecipeScore.objects.get(recipe=self.recipe).trending
+        RecipeScore.objects.update(trending=0)
+        self.add_events(0)
+        update_recipe_scores()
+        new = RecipeScore.objects.get(recipe=self.recipe).trending
+        self.assertAlmostEqual(old - new, math.log(1.5), places=3)
+
+    def test_popular(self):
+        self.user.favorites.add(self.recipe)
+        self.user.shopping_cart.add(self.recipe)
+        self.user.favorites.remove(self.recipe)
+        update_recipe_scores()
+        self.assertEqual(
+            RecipeScore.objects.get(recipe=self.recipe).popular, 1
+        )
+
+
+class GenerateDatasetTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = self.settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def generate(self):
+        """The generated rows with ids relative to the first of each."""
+        with transaction.atomic():
+            generate_dataset(
+                30, 40, seed=7, prefix='gen', ingredients=40, follows=5,
+                favorites=4, cart=2, batch_size=16
+            )
+            users = list(
+                User.objects.filter(username__startswith='gen')
+                .order_by('pk').values_list('pk', flat=True)
+            )
+            first_user = users[0]
+            first_recipe = Recipe.objects.order_by('pk').first().pk
+            rows = {
+                'follows': sorted(
+                    (row.from_user_id - first_user,
+                     row.to_user_id - first_user)
+                    for row in User.following.through.objects.all()
+                ),
+                'favorites': sorted(
+                    (row.user_id - first_user, row.recipe_id - first_recipe)
+                    for row in User.favorites.through.objects.all()
+                ),
+                'ingredients': sorted(
+                    Recipe.objects.annotate(total=Count('ingredients'))
+                    .values_list('total', flat=True)
+                ),
+            }
+            self.assertEqual(
+                list(
+                    Recipe.objects.order_by('pk')
+                    .values_list('favorites_count', flat=True)
+                ),
+                list(
+                    Recipe.objects.order_by('pk')
+                    .annotate(total=Count('recipe_fans'))
+                    .values_list('total', flat=True)
+                )
+            )
+            self.assertEqual(RecipeScore.objects.count(), 40)
+            self.assertTrue(User.objects.get(pk=first_user).check_password(
+                'load-pass-42'
+            ))
+            transaction.set_rollback(True)
+        return rows
 
-# Create your tests here.
+    def test_deterministic(self):
+        rows = self.generate()
+        self.assertEqual(self.generate(), rows)
+        self.assertTrue(rows['follows'])
+        self.assertTrue(rows['favorites'])
+        self.assertEqual(len(rows['ingredients']), 40)
+        self.assertGreaterEqual(rows['ingredients'][0], 5)
+        self.assertLessEqual(rows['ingredients'][-1], 30)
@@ -1,5 +1,28 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as BaseUserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+
+class UserQuerySet(models.QuerySet):
+    def with_is_subscribed(self, user):
+        """Annotate whether ``user`` follows each user of the queryset."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(
+                User.following.through.objects.filter(
+                    from_user=user,
+                    to_user=OuterRef('pk')
+                )
+            )
+        )
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -32,6 +55,11 @@ class User(AbstractUser):
         'recipes.Recipe',
         related_name='shoppers'
     )
+    # Maintained by recipes.signals, rebuilt by rebuild_counters.
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = UserManager()
 
     class Meta:
         constraints = [